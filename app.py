@@ -6,14 +6,15 @@ Run with: streamlit run app.py
 import streamlit as st
 import json
 import os
-import subprocess
 import tempfile
+import threading
 from pathlib import Path
 
 from llm.planner import get_plan_from_user
 from validation.validate import validate_plan, get_validation_report
 from validation.normalize import normalize_plan
 from renderer.actions import ActionFactory, actions_summary
+from renderer.worker import RenderWorker
 from scenes.generated_scene import apply_scene_config
 
 # Load environment variables from .env file
@@ -285,69 +286,68 @@ def create_actions(plan):
         return None
 
 
+@st.cache_resource
+def get_render_worker():
+    # one warm render process for the whole app, started on first use
+    worker = RenderWorker()
+    worker.start()
+    return worker
+
+
+@st.cache_resource
+def get_render_lock():
+    # the worker takes one render at a time, and every session shares it
+    return threading.Lock()
+
+
 def render_animation(plan, quality):
-    quality_flags = {
-        "fast": "-ql",
-        "medium": "-qm",
-        "high": "-qh",
-        "4k": "-qk"
+    quality_names = {
+        "fast": "low",
+        "medium": "medium",
+        "high": "high",
+        "4k": "4k"
     }
     
-    flag = quality_flags.get(quality, "-qm")
-    
-    scene_code = f'''
-from manim import *
-from renderer.actions import ActionFactory, GraphAction
-from renderer.executor import execute_actions
-
-class StreamlitScene(Scene):
-    def construct(self):
-        plan = {json.dumps(plan)}
-        actions = ActionFactory.create_all(plan)
-        execute_actions(self, actions)
-'''
-    
-    temp_path = Path("temp_scene.py")
-    temp_path.write_text(scene_code)
-    
     try:
-        # Use simple environment where possible, or ensure manim is in path
-        cmd = ["manim", flag, str(temp_path), "StreamlitScene", "--format=mp4"]
+        worker = get_render_worker()
         
         # Create progress placeholder
         progress_text = "Rendering animation... This might take a moment."
         my_bar = st.progress(0, text=progress_text)
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        def show_progress(progress):
+            percent = int(progress["step"] * 100 / max(progress["total_steps"], 1))
+            if progress["event"] == "step_started":
+                percent = int((progress["step"] - 1) * 100 / max(progress["total_steps"], 1))
+            text = f"Rendering step {progress['step']}/{progress['total_steps']} ({progress['action_type']})"
+            if progress["eta_seconds"] is not None:
+                text = text + f" - about {progress['eta_seconds']:.0f}s left"
+            my_bar.progress(min(percent, 99), text=text)
+        
+        render_lock = get_render_lock()
+        if not render_lock.acquire(blocking=False):
+            my_bar.progress(0, text="Waiting for another render to finish...")
+            render_lock.acquire()
+        try:
+            video_path, error = worker.render(
+                plan,
+                quality_names.get(quality, "medium"),
+                Path("media"),
+                on_progress=show_progress
+            )
+        finally:
+            render_lock.release()
         
         my_bar.progress(100, text="Rendering complete!")
         
-        if result.returncode == 0:
-            # Locate the output file
-            # Manim output structure: media/videos/temp_scene/quality/StreamlitScene.mp4
-            quality_dir_map = {
-                "fast": "480p15",
-                "medium": "720p30",
-                "high": "1080p60", 
-                "4k": "2160p30"
-            }
-            # Note: actual dir name depends on manim version and config, strictly searching is safer
-            media_dir = Path("media/videos/temp_scene")
-            
-            if media_dir.exists():
-                videos = list(media_dir.rglob("*.mp4"))
-                if videos:
-                    return str(max(videos, key=lambda p: p.stat().st_mtime))
-        else:
-             st.error(f"Manim Error: {result.stderr}")
-             
-        return None
+        if video_path is None:
+            st.error(f"Manim Error: {error}")
+            return None
+        
+        return str(video_path)
     except Exception as e:
         st.error(f"Render Execution Error: {e}")
         return None
-    finally:
-        if temp_path.exists():
-            temp_path.unlink()
 
 
 def main():
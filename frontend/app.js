@@ -5,6 +5,9 @@
 // save the current plan so we can use it later for rendering
 var currentPlan = null;
 
+// id of the render job we are waiting for
+var currentJobId = null;
+
 
 // --- UI HELPERS ---
 
@@ -168,7 +171,8 @@ function handleRender() {
     fetch("/api/render", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ plan: currentPlan, quality: quality })
+        // anything above low quality gets a quick draft to watch first
+        body: JSON.stringify({ plan: currentPlan, quality: quality, draft: quality !== "low" })
     })
     .then(function(response) {
         return response.json().then(function(data) {
@@ -176,39 +180,208 @@ function handleRender() {
         });
     })
     .then(function(result) {
-        hideElement("loadingState");
-        renderBtn.disabled = false;
+        if (!result.ok) {
+            renderFailed(result.data.error || "Rendering failed.");
+            return;
+        }
+
+        // the render is queued, listen for progress until it's finished
+        currentJobId = result.data.job_id;
+        watchRender(currentJobId);
+    })
+    .catch(function(err) {
+        renderFailed("Network error during rendering.");
+    });
+}
+
+function watchRender(jobId) {
+    // older browsers: fall back to asking every second
+    if (typeof EventSource === "undefined") {
+        pollRender(jobId);
+        return;
+    }
+
+    var source = new EventSource("/api/render/" + jobId + "/events");
+
+    source.addEventListener("progress", function(e) {
+        if (jobId !== currentJobId) {
+            source.close();
+            return;
+        }
+        showRenderProgress(JSON.parse(e.data));
+    });
+
+    source.addEventListener("status", function(e) {
+        if (jobId !== currentJobId) {
+            source.close();
+            return;
+        }
+
+        var job = JSON.parse(e.data);
+        if (job.draft_video_url && job.status !== "done") {
+            showDraft(job.draft_video_url);
+        }
+        if (job.status === "queued") {
+            document.getElementById("loadingText").textContent = waitingText(job);
+            return;
+        }
+        if (job.status === "running") {
+            return;
+        }
+
+        source.close();
+        if (job.status === "done") {
+            renderFinished(job.video_url);
+        } else {
+            renderFailed(job.error || "Rendering " + job.status + ".");
+        }
+    });
+
+    source.onerror = function() {
+        // the stream broke before the job finished, so poll instead
+        source.close();
+        if (jobId === currentJobId) {
+            pollRender(jobId);
+        }
+    };
+}
+
+function waitingText(job) {
+    if (job.draft_video_url) {
+        return "Draft ready. Waiting to render full quality...";
+    }
+    return "Waiting for a free render worker...";
+}
+
+function showRenderProgress(progress) {
+    // events that aren't about a rendered step (a draft being ready, ...)
+    if (!progress.step) {
+        return;
+    }
+
+    var text = "Rendering step " + progress.step + " of " + progress.total_steps;
+    if (progress.tier === "draft") {
+        text = "Rendering draft: step " + progress.step + " of " + progress.total_steps;
+    } else if (progress.tier === "final") {
+        text = "Rendering full quality: step " + progress.step + " of " + progress.total_steps;
+    }
+    if (progress.total_segments) {
+        text = text + " (part " + progress.segment + " of " + progress.total_segments + ")";
+    }
+    if (progress.eta_seconds !== null) {
+        text = text + " - about " + Math.ceil(progress.eta_seconds) + "s left";
+    }
+    document.getElementById("loadingText").textContent = text;
+}
+
+function pollRender(jobId) {
+    fetch("/api/render/" + jobId)
+    .then(function(response) {
+        return response.json().then(function(data) {
+            return { ok: response.ok, data: data };
+        });
+    })
+    .then(function(result) {
+        // a newer render replaced this one
+        if (jobId !== currentJobId) {
+            return;
+        }
 
         if (!result.ok) {
-            showElement("planPreview");
-            showError(result.data.error || "Rendering failed.");
-            setStatus("Render failed", "error");
+            renderFailed(result.data.error || "Rendering failed.");
             return;
         }
 
-        // success! show the video
-        var video = document.getElementById("videoPlayer");
-        video.src = result.data.video_url;
+        var job = result.data;
+
+        if (job.draft_video_url && job.status !== "done") {
+            showDraft(job.draft_video_url);
+        }
+
+        if (job.status === "queued" || job.status === "running") {
+            if (job.status === "queued") {
+                document.getElementById("loadingText").textContent = waitingText(job);
+            } else if (job.progress) {
+                showRenderProgress(job.progress);
+            } else {
+                document.getElementById("loadingText").textContent = "Rendering animation with Manim... This may take a minute.";
+            }
+            setTimeout(function() { pollRender(jobId); }, 1000);
+            return;
+        }
 
-        var downloadBtn = document.getElementById("downloadBtn");
-        downloadBtn.href = result.data.video_url;
+        if (job.status !== "done") {
+            renderFailed(job.error || "Rendering " + job.status + ".");
+            return;
+        }
 
-        showElement("videoSection");
-        setStatus("Video ready", "ready");
+        renderFinished(job.video_url);
     })
     .catch(function(err) {
-        hideElement("loadingState");
-        showElement("planPreview");
-        renderBtn.disabled = false;
-        showError("Network error during rendering.");
-        setStatus("Error", "error");
+        renderFailed("Network error during rendering.");
     });
 }
 
+function showDraft(videoUrl) {
+    // play the draft while the full quality video renders
+    var video = document.getElementById("videoPlayer");
+    if (video.getAttribute("src") === videoUrl) {
+        return;
+    }
+    video.src = videoUrl;
+
+    document.getElementById("downloadBtn").href = videoUrl;
+    showElement("videoSection");
+    setStatus("Draft ready", "busy");
+}
+
+function renderFinished(videoUrl) {
+    hideElement("loadingState");
+    document.getElementById("renderBtn").disabled = false;
+    currentJobId = null;
+
+    // success! show the video, picking up where the draft was
+    var video = document.getElementById("videoPlayer");
+    var oldUrl = video.getAttribute("src") || "";
+    var fromDraft = oldUrl.indexOf("/draft.mp4") !== -1;
+    var position = video.currentTime || 0;
+    var wasPlaying = !video.paused;
+    video.src = videoUrl;
+    if (fromDraft && position > 0) {
+        video.addEventListener("loadedmetadata", function() {
+            video.currentTime = position;
+            if (wasPlaying) {
+                video.play();
+            }
+        }, { once: true });
+    }
+
+    var downloadBtn = document.getElementById("downloadBtn");
+    downloadBtn.href = videoUrl;
+
+    showElement("videoSection");
+    setStatus("Video ready", "ready");
+}
+
+function renderFailed(message) {
+    hideElement("loadingState");
+    showElement("planPreview");
+    document.getElementById("renderBtn").disabled = false;
+    currentJobId = null;
+    showError(message);
+    setStatus("Render failed", "error");
+}
+
 
 // --- RESET ---
 
 function resetAll() {
+    // stop waiting for a render that's still going
+    if (currentJobId !== null) {
+        fetch("/api/render/" + currentJobId, { method: "DELETE" });
+        currentJobId = null;
+    }
+
     currentPlan = null;
     hideElement("planPreview");
     hideElement("videoSection");
@@ -0,0 +1,163 @@
+"""
+Benchmark - how many plans a second the prompt -> plan pipeline manages.
+
+Starts the local stand-in (llm/standin.py) on a free port and sends it
+prompts through the same LLMClient and planner the server uses, so no
+network is needed and runs can be compared with each other.
+
+Run with: python -m llm.benchmark --requests 200 --concurrency 20
+Add --stream to read the replies as they are written (also measures
+how long the first step takes), --fail-rate / --bad-rate / --cut-rate to
+see how retries hold up, or --base-url to use a stand-in that is
+already running.
+"""
+
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+import uvicorn
+
+from llm.client import Backend, LLMClient
+from llm.planner import get_plan_async, stream_plan_async
+from llm.standin import make_app
+
+
+PROMPTS = [
+    "Show a sine wave",
+    "Explain the Pythagorean theorem",
+    "Graph a parabola",
+    "Area of a circle",
+    "E = mc^2",
+    "Draw some shapes",
+    "Euler's identity",
+    "Plot a cubic",
+    "Square root function",
+    "Cosine and its phase shift",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_standin(args):
+    """Run the stand-in in a background thread. Returns its base URL."""
+    app = make_app(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        chunk_chars=args.chunk_chars,
+        fail_rate=args.fail_rate,
+        bad_rate=args.bad_rate,
+        cut_rate=args.cut_rate,
+        seed=args.seed,
+    )
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="critical"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    return "http://127.0.0.1:" + str(port) + "/v1", server
+
+
+def percentile(values, share):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(share * (len(values) - 1))))
+    return values[index]
+
+
+async def run(args, base_url):
+    client = LLMClient(
+        backend=Backend(base_url=base_url, model="standin", api_key="standin"),
+        max_concurrency=args.concurrency,
+    )
+    # keep the request count exact, no matter how many the client allows
+    gate = asyncio.Semaphore(args.concurrency)
+
+    latencies = []
+    first_steps = []
+    errors = {}
+
+    async def one(index):
+        prompt = PROMPTS[index % len(PROMPTS)]
+        async with gate:
+            started = time.perf_counter()
+
+            if args.stream:
+                first = []
+
+                def on_step(step):
+                    if len(first) == 0:
+                        first.append(time.perf_counter() - started)
+
+                plan, error = await stream_plan_async(prompt, client, on_step)
+                if len(first) > 0:
+                    first_steps.append(first[0])
+            else:
+                plan, error = await get_plan_async(prompt, client)
+
+            if plan is None:
+                errors[error] = errors.get(error, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(index) for index in range(args.requests)])
+    elapsed = time.perf_counter() - started
+    await client.close()
+
+    print("requests:     " + str(args.requests) + " (" + str(args.concurrency) + " at a time)")
+    print("plans:        " + str(len(latencies)))
+    print("elapsed:      " + format(elapsed, ".2f") + " s")
+    print("throughput:   " + format(len(latencies) / elapsed, ".1f") + " plans/s")
+    print("latency p50:  " + format(percentile(latencies, 0.5), ".3f") + " s")
+    print("latency p95:  " + format(percentile(latencies, 0.95), ".3f") + " s")
+    print("latency p99:  " + format(percentile(latencies, 0.99), ".3f") + " s")
+    if args.stream:
+        print("first step p50: " + format(percentile(first_steps, 0.5), ".3f") + " s")
+        print("first step p95: " + format(percentile(first_steps, 0.95), ".3f") + " s")
+    for error, count in errors.items():
+        print("failed (" + str(count) + "): " + str(error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt -> plan against the local stand-in.")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--base-url", default=None,
+                        help="use a stand-in that is already running instead of starting one")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--chunk-chars", type=int, default=8)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument("--bad-rate", type=float, default=0)
+    parser.add_argument("--cut-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        base_url, server = start_standin(args)
+
+    try:
+        asyncio.run(run(args, base_url))
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
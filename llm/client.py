@@ -0,0 +1,329 @@
+"""
+Client - talks to the AI provider without tying up the server.
+
+- one pooled httpx.AsyncClient, so connections are kept alive and reused
+- a semaphore, so only so many AI calls run at once
+- retries with jittered exponential backoff for timeouts, 429s and 5xx
+- a circuit breaker: after several failures in a row we stop calling the
+  provider for a while and fail straight away, then let one call through
+  to see if it's back
+
+stream_chat asks for a streamed reply and hands over the text as it
+arrives (see llm/stream_parser.py for reading steps out of it).
+
+Any OpenAI-compatible chat completions API will do. A Backend says which
+one: LLM_BASE_URL and LLM_MODEL pick it (Pollinations by default), and
+LLM_API_KEY (or POLLINATION_API_KEY) is sent as the bearer token.
+llm/standin.py is a local stand-in for testing without the network.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+
+import httpx
+
+
+DEFAULT_BASE_URL = "https://gen.pollinations.ai/v1"
+DEFAULT_MODEL = "openai"
+
+# give up on one AI call after this many seconds
+DEFAULT_TIMEOUT = 60
+
+# AI calls running at the same time
+DEFAULT_MAX_CONCURRENCY = 8
+
+# extra tries after the first one, for errors that might go away
+DEFAULT_MAX_RETRIES = 3
+
+# backoff before retry n is a random time up to BACKOFF_BASE * 2^n, capped
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+
+# the breaker opens after this many failures in a row...
+DEFAULT_BREAKER_FAILURES = 5
+# ...and lets a test call through after this many seconds
+DEFAULT_BREAKER_RESET_SECONDS = 30
+
+# status codes worth retrying
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+BREAKER_OPEN_ERROR = "The AI service is not responding right now. Please try again in a minute."
+
+
+def backoff_delay(attempt):
+    """How long to wait before retry number attempt (1, 2, ...), with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def retry_after_seconds(response):
+    """How long a 429 or 503 asked us to back off for (0 if it didn't say)."""
+    try:
+        return min(float(response.headers.get("Retry-After", "0")), BACKOFF_MAX)
+    except ValueError:
+        return 0
+
+
+class Backend:
+    """One OpenAI-compatible chat completions API and the model to ask."""
+
+    def __init__(self, base_url=None, model=None, api_key=None, name=None):
+        self.base_url = (base_url or os.getenv("LLM_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.model = model or os.getenv("LLM_MODEL") or DEFAULT_MODEL
+        self.api_key = api_key
+        self.name = name or self.model
+        self.url = self.base_url + "/chat/completions"
+
+    def get_api_key(self):
+        # read when the call is made, so a key from .env is picked up
+        return self.api_key or os.getenv("LLM_API_KEY") or os.getenv("POLLINATION_API_KEY")
+
+
+def build_request(system_message, user_prompt, api_key=None, model=DEFAULT_MODEL, stream=False):
+    """The headers and JSON body for a chat completion request."""
+    headers = {
+        "Content-Type": "application/json",
+    }
+    if api_key:
+        headers["Authorization"] = "Bearer " + api_key
+
+    body = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": 0.4,
+        "max_tokens": 4096,
+    }
+    if stream:
+        body["stream"] = True
+    return headers, body
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through.
+    open: calls fail straight away until reset_seconds have passed.
+    half_open: one test call goes through; success closes, failure opens again.
+    """
+
+    def __init__(self, max_failures=None, reset_seconds=None):
+        self.max_failures = max_failures or DEFAULT_BREAKER_FAILURES
+        self.reset_seconds = reset_seconds or DEFAULT_BREAKER_RESET_SECONDS
+
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.testing = False
+
+    def allow(self):
+        """True if a call may go ahead now."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+
+            if self.state == "open":
+                if time.time() - self.opened_at < self.reset_seconds:
+                    return False
+                self.state = "half_open"
+                self.testing = False
+
+            # half open: only one test call at a time
+            if self.testing:
+                return False
+            self.testing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.testing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures = self.failures + 1
+            self.testing = False
+            if self.state == "half_open" or self.failures >= self.max_failures:
+                if self.state != "open":
+                    print("AI service keeps failing, pausing calls for "
+                          + str(self.reset_seconds) + " seconds.")
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def is_open(self):
+        with self.lock:
+            return self.state == "open" and time.time() - self.opened_at < self.reset_seconds
+
+
+class LLMClient:
+
+    def __init__(self, backend=None, timeout=None, max_concurrency=None,
+                 max_retries=None, breaker=None):
+        self.backend = backend or Backend()
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        if max_retries is None:
+            max_retries = DEFAULT_MAX_RETRIES
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+
+        # made on first use, inside the server's event loop
+        self.client = None
+        self.semaphore = None
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def chat(self, system_message, user_prompt):
+        """
+        Send one chat request.
+        Returns two things: the AI's text and an error message.
+        If it works, error will be None. If it fails, text will be None.
+        """
+        headers, body = build_request(system_message, user_prompt,
+                                      self.backend.get_api_key(), self.backend.model)
+        client = self._get_client()
+
+        error = "AI call failed."
+        retry_after = 0
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(max(backoff_delay(attempt), retry_after))
+                retry_after = 0
+
+            if not self.breaker.allow():
+                return None, BREAKER_OPEN_ERROR
+
+            try:
+                async with self.semaphore:
+                    response = await client.post(self.backend.url, headers=headers, json=body)
+            except httpx.HTTPError as http_error:
+                error = "Error calling AI: " + (str(http_error) or http_error.__class__.__name__)
+                print(error)
+                self.breaker.record_failure()
+                continue
+
+            if response.status_code == 200:
+                try:
+                    text = response.json()["choices"][0]["message"]["content"]
+                except Exception as parse_error:
+                    # the provider is up, it just sent something odd
+                    self.breaker.record_success()
+                    return None, "AI sent a response we couldn't read: " + str(parse_error)
+                self.breaker.record_success()
+                return text, None
+
+            print("AI returned error status: " + str(response.status_code))
+            error = "AI returned error status: " + str(response.status_code)
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                # the provider is up but didn't like our request,
+                # trying again won't help
+                self.breaker.record_success()
+                return None, error
+
+            self.breaker.record_failure()
+            retry_after = retry_after_seconds(response)
+
+        return None, error
+
+    async def stream_chat(self, system_message, user_prompt, on_text):
+        """
+        Send one chat request and read the reply as it is written.
+        on_text is called with each new piece of text.
+        Returns two things: the whole text and an error message.
+
+        Failures before the first piece of text are retried like chat();
+        once text has been handed to on_text, a failure just ends the call.
+        """
+        headers, body = build_request(system_message, user_prompt,
+                                      self.backend.get_api_key(), self.backend.model,
+                                      stream=True)
+        client = self._get_client()
+
+        error = "AI call failed."
+        pieces = []
+        retry_after = 0
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(max(backoff_delay(attempt), retry_after))
+                retry_after = 0
+
+            if not self.breaker.allow():
+                return None, BREAKER_OPEN_ERROR
+
+            try:
+                async with self.semaphore:
+                    async with client.stream("POST", self.backend.url, headers=headers, json=body) as response:
+                        if response.status_code != 200:
+                            error = "AI returned error status: " + str(response.status_code)
+                            print(error)
+                            if response.status_code not in RETRY_STATUS_CODES:
+                                self.breaker.record_success()
+                                return None, error
+                            self.breaker.record_failure()
+                            retry_after = retry_after_seconds(response)
+                            continue
+
+                        async for line in response.aiter_lines():
+                            text = read_stream_line(line)
+                            if text is None:
+                                continue
+                            if text == "[DONE]":
+                                break
+                            pieces.append(text)
+                            on_text(text)
+
+            except httpx.HTTPError as http_error:
+                error = "Error calling AI: " + (str(http_error) or http_error.__class__.__name__)
+                print(error)
+                self.breaker.record_failure()
+                if len(pieces) > 0:
+                    return None, error
+                continue
+
+            self.breaker.record_success()
+            return "".join(pieces), None
+
+        return None, error
+
+
+def read_stream_line(line):
+    """
+    The text in one server-sent event line of a streamed reply,
+    "[DONE]" at the end, or None for lines without text.
+    """
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return data
+
+    try:
+        delta = json.loads(data)["choices"][0].get("delta", {})
+    except (ValueError, KeyError, IndexError):
+        return None
+
+    return delta.get("content") or None
@@ -0,0 +1,188 @@
+"""
+Hedge - ask more than one AI backend for the same plan, keep the first good one.
+
+A slow or failing provider sets how long /api/generate takes. With
+hedging the prompt goes to the first backend, and if no usable plan has
+come back after delay seconds (or that backend failed) it also goes to
+the next one, and so on. The first plan that passes validate_plan wins
+and the calls still running are cancelled. delay=0 asks every backend
+straight away.
+
+How often each backend wins and how long it takes is recorded, see
+stats().
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+from llm.client import Backend, LLMClient
+from llm.planner import get_plan_async
+from validation.validate import validate_plan
+
+
+# wait this long for a backend before asking the next one too
+DEFAULT_HEDGE_DELAY = 2
+
+# latencies kept per backend for the percentiles in stats()
+LATENCY_WINDOW = 200
+
+
+def parse_backends(text):
+    """
+    Read backends like "https://a.example/v1|model-a,https://b.example/v1|model-b".
+    A third part names the environment variable holding that backend's key:
+    "https://b.example/v1|model-b|B_API_KEY". Entries without a model are skipped.
+    """
+    backends = []
+    for entry in text.split(","):
+        parts = [part.strip() for part in entry.split("|")]
+        if len(parts) < 2 or parts[0] == "" or parts[1] == "":
+            continue
+
+        api_key = None
+        if len(parts) > 2 and parts[2] != "":
+            api_key = os.getenv(parts[2])
+
+        host = parts[0].split("://")[-1].split("/")[0]
+        backends.append(Backend(base_url=parts[0], model=parts[1], api_key=api_key,
+                                name=parts[1] + "@" + host))
+    return backends
+
+
+def percentile(values, share):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+class HedgedPlanner:
+
+    def __init__(self, clients, delay=None):
+        # LLMClients, asked in this order
+        self.clients = clients
+        if delay is None:
+            delay = DEFAULT_HEDGE_DELAY
+        self.delay = delay
+
+        self.lock = threading.Lock()
+        self.counts = {}
+        for client in clients:
+            self.counts[client.backend.name] = {
+                "requests": 0,
+                "wins": 0,
+                "failures": 0,
+                "cancelled": 0,
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+            }
+
+    @classmethod
+    def from_backends(cls, first_client, backends, delay=None):
+        """A planner for first_client plus a client for each extra backend."""
+        clients = [first_client]
+        for backend in backends:
+            clients.append(LLMClient(
+                backend=backend,
+                timeout=first_client.timeout,
+                max_concurrency=first_client.max_concurrency,
+                max_retries=first_client.max_retries,
+            ))
+        return cls(clients, delay=delay)
+
+    def all_down(self):
+        """True while every backend's circuit breaker is open."""
+        for client in self.clients:
+            if not client.breaker.is_open():
+                return False
+        return True
+
+    async def get_plan(self, user_prompt):
+        """
+        Get a plan from whichever backend gives a good one first.
+        Returns two things: the plan (dict) and an error message (string).
+        """
+        running = {}
+        next_index = 0
+        error = None
+
+        try:
+            while True:
+                # start the next backend if it's time (or nothing else is running)
+                if next_index < len(self.clients) and (len(running) == 0 or self.delay == 0):
+                    self._start(user_prompt, next_index, running)
+                    next_index = next_index + 1
+                    continue
+
+                if len(running) == 0:
+                    break
+
+                timeout = None
+                if next_index < len(self.clients):
+                    timeout = self.delay
+                done, pending = await asyncio.wait(list(running), timeout=timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+
+                if len(done) == 0:
+                    # the hedge delay passed without an answer
+                    self._start(user_prompt, next_index, running)
+                    next_index = next_index + 1
+                    continue
+
+                for task in done:
+                    name, started = running.pop(task)
+                    plan, task_error = task.result()
+
+                    if plan is not None and validate_plan(plan):
+                        self._record(name, "wins", time.perf_counter() - started)
+                        return plan, None
+
+                    self._record(name, "failures", time.perf_counter() - started)
+                    error = task_error or "AI produced an invalid plan."
+
+                    # this one failed, don't wait out the delay for the next
+                    if next_index < len(self.clients):
+                        self._start(user_prompt, next_index, running)
+                        next_index = next_index + 1
+        finally:
+            for task in running:
+                task.cancel()
+                self._record(running[task][0], "cancelled")
+
+        return None, error or "Could not generate an animation plan. Please try again."
+
+    def stats(self):
+        """Requests, wins, win rate and latency percentiles for each backend."""
+        with self.lock:
+            result = {}
+            for name, counts in self.counts.items():
+                latencies = list(counts["latencies"])
+                win_rate = None
+                if counts["requests"] > 0:
+                    win_rate = round(counts["wins"] / counts["requests"], 3)
+                result[name] = {
+                    "requests": counts["requests"],
+                    "wins": counts["wins"],
+                    "failures": counts["failures"],
+                    "cancelled": counts["cancelled"],
+                    "win_rate": win_rate,
+                    "latency_p50": percentile(latencies, 0.5),
+                    "latency_p95": percentile(latencies, 0.95),
+                }
+            return {"delay": self.delay, "backends": result}
+
+    def _start(self, user_prompt, index, running):
+        client = self.clients[index]
+        # one try each: a bad reply is what the other backends are for
+        task = asyncio.ensure_future(get_plan_async(user_prompt, client, tries=1))
+        running[task] = (client.backend.name, time.perf_counter())
+        self._record(client.backend.name, "requests")
+
+    def _record(self, name, what, latency=None):
+        with self.lock:
+            counts = self.counts[name]
+            counts[what] = counts[what] + 1
+            if latency is not None:
+                counts["latencies"].append(round(latency, 3))
@@ -0,0 +1,278 @@
+"""
+Plan cache - remembers the plans the AI wrote for earlier prompts.
+
+"Show a sine wave" and "show sine wave graph" want the same animation,
+so a prompt is looked up two ways:
+- exactly, after normalizing it (lowercase, no punctuation or extra spaces)
+- by similarity: the prompt's words (minus stopwords like "a", "the",
+  "show") are turned into a MinHash signature, and locality sensitive
+  hashing finds earlier prompts that share enough words. Those are then
+  compared properly and the closest one above the threshold is used.
+  The numbers and math in both prompts must be exactly the same though:
+  "solve 2x + 3 = 7" and "solve 2x + 3 = 9" share most of their words
+  but need different animations.
+
+Only plans that passed validation are stored. Entries expire after a
+while, the least recently used go first when the cache is full, and
+everything is dropped when the system prompt changes, since plans
+written for other instructions may not fit anymore.
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ITEMS = 1000
+
+# how many words two prompts must share (Jaccard similarity) to share a plan
+DEFAULT_SIMILARITY = 0.6
+
+# prompts with fewer words than this left only match exactly: "what is
+# it" has no words left at all, and one word says too little to go on
+MIN_WORDS = 2
+
+# MinHash signature length, split into bands for LSH. Two prompts become
+# candidates when every value of at least one band matches
+NUM_HASHES = 64
+BAND_SIZE = 2
+
+# words that don't change what the animation should be
+STOPWORDS = set("""
+a an the and or of to in on for with by at from as is are be this that it its
+show shows showing me us please can you could would make create draw animate
+animation visualize visualise explain display demonstrate illustrate how what
+""".split())
+
+# words that are really numbers, compared like numbers
+NUMBER_WORDS = set("""
+zero one two three four five six seven eight nine ten eleven twelve twenty hundred
+thousand half third quarter squared cubed
+""".split())
+
+MATH_SYMBOLS = re.compile(r"[0-9^+\-*/=()]")
+
+# the hash functions are random but fixed, so signatures stay comparable
+_rng = random.Random(12345)
+_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for i in range(NUM_HASHES)]
+
+
+def normalize_prompt(prompt):
+    """Lowercase, drop punctuation and squeeze the spaces."""
+    text = re.sub(r"[^a-z0-9^+\-*/=().\s]", " ", prompt.lower())
+    text = re.sub(r"[.]+(\s|$)", " ", text)
+    return " ".join(text.split())
+
+
+def prompt_words(prompt):
+    """The words of a prompt that matter, as a set."""
+    words = set()
+    for word in normalize_prompt(prompt).split():
+        if word in STOPWORDS:
+            continue
+        # "waves" and "wave" are the same thing here
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def prompt_math(prompt):
+    """
+    The numbers, number words and formulas of a prompt, in order.
+    Prompts only share a plan when these match exactly.
+    """
+    tokens = []
+    for word in normalize_prompt(prompt).split():
+        if word in NUMBER_WORDS or MATH_SYMBOLS.search(word):
+            tokens.append(word)
+    return tokens
+
+
+def minhash(words):
+    """The MinHash signature of a set of words."""
+    values = []
+    for word in words:
+        values.append(int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "big"))
+
+    signature = []
+    for a, b in _PERMUTATIONS:
+        if len(values) == 0:
+            signature.append(0)
+        else:
+            signature.append(min((a * v + b) % _PRIME for v in values))
+    return signature
+
+
+def jaccard(a, b):
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class PlanCache:
+
+    def __init__(self, version, ttl=None, max_items=None, similarity=None, path=None):
+        # changes whenever the system prompt does (see llm/planner.py)
+        self.version = version
+        self.ttl = ttl or DEFAULT_TTL
+        self.max_items = max_items or DEFAULT_MAX_ITEMS
+        self.similarity = similarity or DEFAULT_SIMILARITY
+        # optional json file so the cache survives restarts
+        self.path = Path(path) if path else None
+
+        self.lock = threading.Lock()
+        # normalized prompt -> entry, least recently used first
+        self.entries = OrderedDict()
+        # (band number, band values) -> normalized prompts in that bucket
+        self.buckets = {}
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        if self.path is not None:
+            self._load()
+
+    def lookup(self, prompt):
+        """
+        Find a plan for this prompt or one close to it.
+        Returns the plan, or None.
+        """
+        key = normalize_prompt(prompt)
+
+        with self.lock:
+            entry = self._get_fresh(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return entry["plan"]
+
+            words = prompt_words(prompt)
+            math = prompt_math(prompt)
+            best = None
+            best_score = 0
+            candidates = []
+            if len(words) >= MIN_WORDS:
+                candidates = self._candidates(minhash(words))
+            for other_key in candidates:
+                other = self._get_fresh(other_key)
+                if other is None or len(other["words"]) < MIN_WORDS:
+                    continue
+                # "= 7" and "= 9" are different problems, however alike the words
+                if other.get("math", prompt_math(other_key)) != math:
+                    continue
+                score = jaccard(words, set(other["words"]))
+                if score >= self.similarity and score > best_score:
+                    best = other
+                    best_score = score
+
+            if best is None:
+                self.misses = self.misses + 1
+                return None
+
+            self.entries.move_to_end(best["key"])
+            self.near_hits = self.near_hits + 1
+            return best["plan"]
+
+    def store(self, prompt, plan):
+        """Remember the plan written for a prompt."""
+        key = normalize_prompt(prompt)
+        words = prompt_words(prompt)
+
+        with self.lock:
+            self._remove(key)
+            entry = {
+                "key": key,
+                "words": sorted(words),
+                "math": prompt_math(prompt),
+                "signature": minhash(words),
+                "plan": plan,
+                "saved_at": time.time(),
+            }
+            self.entries[key] = entry
+            for bucket in self._bands(entry["signature"]):
+                self.buckets.setdefault(bucket, set()).add(key)
+
+            while len(self.entries) > self.max_items:
+                old_key = next(iter(self.entries))
+                self._remove(old_key)
+
+            if self.path is not None:
+                self._save()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "items": len(self.entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+            }
+
+    def _get_fresh(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["saved_at"] > self.ttl:
+            self._remove(key)
+            return None
+        return entry
+
+    def _candidates(self, signature):
+        keys = set()
+        for bucket in self._bands(signature):
+            keys.update(self.buckets.get(bucket, ()))
+        return keys
+
+    def _bands(self, signature):
+        bands = []
+        for start in range(0, len(signature), BAND_SIZE):
+            bands.append((start, tuple(signature[start:start + BAND_SIZE])))
+        return bands
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for bucket in self._bands(entry["signature"]):
+            keys = self.buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.buckets[bucket]
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+        except Exception as error:
+            print("Could not read plan cache: " + str(error))
+            return
+
+        # plans written for a different system prompt are no good
+        if data.get("version") != self.version:
+            print("System prompt changed, starting with an empty plan cache.")
+            return
+
+        for entry in data.get("entries", []):
+            self.entries[entry["key"]] = entry
+            for bucket in self._bands(entry["signature"]):
+                self.buckets.setdefault(bucket, set()).add(entry["key"])
+
+    def _save(self):
+        data = {"version": self.version, "entries": list(self.entries.values())}
+        temp_path = self.path.with_suffix(".tmp")
+        try:
+            temp_path.write_text(json.dumps(data))
+            temp_path.replace(self.path)
+        except Exception as error:
+            print("Could not save plan cache: " + str(error))
@@ -1,12 +1,19 @@
-import os
 import json
 import re
+import time
+import hashlib
 import requests
 from dotenv import load_dotenv
 
+from llm.client import Backend, build_request, backoff_delay
+from llm.stream_parser import StepParser
+
 # load the .env file so we can use the API key
 load_dotenv()
 
+# one session for every call, so the connection to the AI is reused
+session = requests.Session()
+
 
 def get_plan_from_user(user_prompt):
     """
@@ -29,6 +36,10 @@ def get_plan_from_user(user_prompt):
     while tries < max_tries:
         tries = tries + 1
 
+        # wait a bit before trying again, so we don't hammer a struggling AI
+        if tries > 1:
+            time.sleep(backoff_delay(tries - 1))
+
         # call the AI
         ai_text = call_ai(system_message, user_prompt)
 
@@ -47,6 +58,76 @@ def get_plan_from_user(user_prompt):
     return None, "Could not generate an animation plan. Please try again."
 
 
+async def get_plan_async(user_prompt, client, tries=2):
+    """
+    Same as get_plan_from_user, but for the server: the AI call goes
+    through client (an llm.client.LLMClient) and doesn't block a thread.
+    tries is how many times to ask when the reply isn't a plan.
+    Returns two things: the plan (dict) and an error message (string).
+    """
+    if not user_prompt or user_prompt.strip() == "":
+        return None, "Please type something first."
+
+    system_message = build_system_prompt()
+
+    # the client already retries network errors, these tries are for bad output
+    error = None
+    for attempt in range(tries):
+        ai_text, error = await client.chat(system_message, user_prompt)
+
+        if ai_text is None:
+            # no point asking again while the AI is down
+            if client.breaker.is_open():
+                return None, error
+            continue
+
+        plan = get_json_from_text(ai_text)
+        if plan is not None:
+            return plan, None
+
+    return None, "Could not generate an animation plan. Please try again."
+
+
+async def stream_plan_async(user_prompt, client, on_step):
+    """
+    Like get_plan_async, but the AI's reply is read as it is written and
+    on_step(step) is called for each step as soon as it is complete.
+    Returns two things: the plan (dict) and an error message (string).
+    """
+    if not user_prompt or user_prompt.strip() == "":
+        return None, "Please type something first."
+
+    system_message = build_system_prompt()
+
+    error = None
+    for tries in range(2):
+        parser = StepParser()
+
+        def read_text(text):
+            for step in parser.feed(text):
+                on_step(step)
+
+        ai_text, error = await client.stream_chat(system_message, user_prompt, read_text)
+
+        if ai_text is None:
+            # steps already handed out can't be taken back, so don't start over
+            if len(parser.steps) > 0 or client.breaker.is_open():
+                return None, error
+            continue
+
+        if len(parser.steps) > 0:
+            return {"steps": parser.steps}, None
+
+        # the steps weren't where the parser looked, try the whole reply
+        plan = get_json_from_text(ai_text)
+        if plan is not None:
+            for step in plan["steps"]:
+                on_step(step)
+            return plan, None
+
+    return None, "Could not generate an animation plan. Please try again."
+
+
 def build_system_prompt():
     """
     This is the instruction we give to the AI so it knows
@@ -113,39 +194,31 @@ Now create a plan for the user's request."""
     return prompt
 
 
+def system_prompt_version():
+    """
+    A short hash of the system prompt. Cached plans are only reused
+    while this stays the same (see llm/plan_cache.py).
+    """
+    return hashlib.sha256(build_system_prompt().encode()).hexdigest()[:16]
+
+
 def call_ai(system_message, user_prompt):
     """
-    Sends the prompt to Pollination AI and gets back the response text.
+    Sends the prompt to the AI and gets back the response text.
     Returns None if something goes wrong.
     """
 
-    # get the API key from .env file
-    api_key = os.getenv("POLLINATION_API_KEY")
-
-    # set up the headers
-    headers = {
-        "Content-Type": "application/json",
-    }
-
-    # add API key if we have one
-    if api_key:
-        headers["Authorization"] = "Bearer " + api_key
-
-    # build the request body (this is what we send to the AI)
-    body = {
-        "model": "openai",
-        "messages": [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": user_prompt},
-        ],
-        "temperature": 0.4,
-        "max_tokens": 4096,
-    }
+    # which AI to ask (LLM_BASE_URL / LLM_MODEL, see llm/client.py)
+    backend = Backend()
+
+    # build the headers and body (this is what we send to the AI)
+    headers, body = build_request(system_message, user_prompt,
+                                  backend.get_api_key(), backend.model)
 
     # send the request
     try:
-        response = requests.post(
-            "https://gen.pollinations.ai/v1/chat/completions",
+        response = session.post(
+            backend.url,
             headers=headers,
             json=body,
             timeout=60,
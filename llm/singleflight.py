@@ -0,0 +1,70 @@
+"""
+SingleFlight - share one running call between identical requests.
+
+If ten people click "Sine Wave" at the same moment, only the first
+request calls the AI. The other nine wait for it and get the same
+answer. AsyncSingleFlight does this for coroutines on one event loop.
+RecentResults keeps answers around for a while so a client that
+retries with the same idempotency key gets the original answer.
+"""
+
+import time
+import asyncio
+import threading
+
+
+class AsyncSingleFlight:
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func, *args):
+        """
+        Await func(*args), unless a call with the same key is already
+        running, in which case wait for that one and return its result.
+        """
+        future = self.calls.get(key)
+        if future is not None:
+            # shield it, so one waiter giving up doesn't cancel it for everyone
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(func(*args))
+        self.calls[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+
+
+class RecentResults:
+    """A small dict whose entries expire after ttl seconds."""
+
+    def __init__(self, ttl=600, max_items=1000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+
+            saved_at, value = item
+            if time.time() - saved_at > self.ttl:
+                del self.items[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = (time.time(), value)
+
+            # drop the oldest entries if we have too many
+            if len(self.items) > self.max_items:
+                by_age = sorted(self.items, key=lambda k: self.items[k][0])
+                for old_key in by_age[:len(self.items) - self.max_items]:
+                    del self.items[old_key]
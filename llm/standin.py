@@ -0,0 +1,172 @@
+"""
+Stand-in - a local, OpenAI-compatible AI for testing without the network.
+
+Answers POST /v1/chat/completions with a plan from llm/fixtures/plans.json:
+the one whose keywords best match the user's prompt, or one picked from
+the prompt's hash when nothing matches, so the same prompt always gets
+the same plan. "stream": true replies come a few characters at a time
+like a real provider's tokens.
+
+Run with: uvicorn llm.standin:app --port 8100
+and point the app at it with LLM_BASE_URL=http://127.0.0.1:8100/v1
+
+Settings (environment variables, or make_app arguments):
+- STANDIN_LATENCY: seconds before the reply starts (default 0.5)
+- STANDIN_JITTER: up to this many extra random seconds (default 0)
+- STANDIN_TOKEN_DELAY: seconds between streamed pieces (default 0.01)
+- STANDIN_CHUNK_CHARS: characters per streamed piece (default 8)
+- STANDIN_FAIL_RATE: share of requests answered with STANDIN_FAIL_STATUS (default 503)
+- STANDIN_BAD_RATE: share of requests answered with text that isn't a plan
+- STANDIN_CUT_RATE: share of streamed replies that stop halfway
+- STANDIN_SEED: seed for the random choices above, so runs repeat
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+FIXTURES_PATH = Path(__file__).parent / "fixtures" / "plans.json"
+
+BAD_REPLY = "Sorry, I can't make an animation plan for that right now."
+
+
+def load_fixtures(path=FIXTURES_PATH):
+    with open(path) as file:
+        return json.load(file)
+
+
+def pick_plan(fixtures, prompt):
+    """The fixture plan for a prompt. Same prompt, same plan."""
+    words = set(prompt.lower().replace("(", " ").replace(")", " ").split())
+
+    best = None
+    best_score = 0
+    for fixture in fixtures:
+        score = len(words & set(fixture["keywords"]))
+        if score > best_score:
+            best = fixture
+            best_score = score
+
+    if best is None:
+        digest = hashlib.sha256(prompt.encode()).digest()
+        best = fixtures[digest[0] % len(fixtures)]
+
+    return best["plan"]
+
+
+def env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+def make_app(latency=None, jitter=None, token_delay=None, chunk_chars=None,
+             fail_rate=None, fail_status=None, bad_rate=None, cut_rate=None,
+             seed=None, fixtures=None):
+    """Build a stand-in app. Settings not given come from the environment."""
+    if latency is None:
+        latency = env_float("STANDIN_LATENCY", 0.5)
+    if jitter is None:
+        jitter = env_float("STANDIN_JITTER", 0)
+    if token_delay is None:
+        token_delay = env_float("STANDIN_TOKEN_DELAY", 0.01)
+    if chunk_chars is None:
+        chunk_chars = int(os.getenv("STANDIN_CHUNK_CHARS", "8"))
+    if fail_rate is None:
+        fail_rate = env_float("STANDIN_FAIL_RATE", 0)
+    if fail_status is None:
+        fail_status = int(os.getenv("STANDIN_FAIL_STATUS", "503"))
+    if bad_rate is None:
+        bad_rate = env_float("STANDIN_BAD_RATE", 0)
+    if cut_rate is None:
+        cut_rate = env_float("STANDIN_CUT_RATE", 0)
+    if seed is None:
+        seed = int(os.getenv("STANDIN_SEED", "0"))
+    if fixtures is None:
+        fixtures = load_fixtures()
+
+    rng = random.Random(seed)
+    stats = {"requests": 0, "streamed": 0, "failed": 0, "bad": 0, "cut": 0}
+
+    app = FastAPI()
+
+    @app.get("/stats")
+    def get_stats():
+        """How many requests came in, and what was done to them."""
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] = stats["requests"] + 1
+
+        prompt = ""
+        for message in body.get("messages", []):
+            if message.get("role") == "user":
+                prompt = message.get("content", "")
+        model = body.get("model", "standin")
+        stream = body.get("stream", False)
+
+        # roll the dice for everything up front, so the order of rolls
+        # doesn't depend on how long each request takes
+        delay = latency + rng.uniform(0, jitter)
+        fail = rng.random() < fail_rate
+        bad = rng.random() < bad_rate
+        cut = rng.random() < cut_rate
+
+        await asyncio.sleep(delay)
+
+        if fail:
+            stats["failed"] = stats["failed"] + 1
+            return JSONResponse(status_code=fail_status,
+                                content={"error": {"message": "Injected failure."}})
+
+        if bad:
+            stats["bad"] = stats["bad"] + 1
+            text = BAD_REPLY
+        else:
+            text = json.dumps(pick_plan(fixtures, prompt), indent=2)
+
+        if not stream:
+            return {
+                "id": "standin-" + str(stats["requests"]),
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+            }
+
+        stats["streamed"] = stats["streamed"] + 1
+        if cut:
+            stats["cut"] = stats["cut"] + 1
+
+        async def send_pieces():
+            end = len(text)
+            if cut:
+                end = len(text) // 2
+            for start in range(0, end, chunk_chars):
+                if token_delay > 0:
+                    await asyncio.sleep(token_delay)
+                piece = {"choices": [{"index": 0, "delta": {"content": text[start:min(start + chunk_chars, end)]}}]}
+                yield "data: " + json.dumps(piece) + "\n\n"
+            if cut:
+                # drop the connection without finishing the reply
+                raise ConnectionResetError("Injected cut.")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(send_pieces(), media_type="text/event-stream")
+
+    return app
+
+
+app = make_app()
@@ -0,0 +1,95 @@
+"""
+Stream parser - pulls plan steps out of the AI's reply while it is
+still being written.
+
+The reply looks like {"steps": [{...}, {...}, ...]}, maybe wrapped in a
+markdown fence. Feed the text in as it arrives and every step object is
+handed back as soon as its closing brace shows up, so step 1 can be
+checked (and even rendered) while the AI is still writing step 10.
+Each character is looked at once.
+"""
+
+import re
+import json
+
+
+# where the steps array starts
+STEPS_START = re.compile(r'"steps"\s*:\s*\[')
+
+
+class StepParser:
+
+    def __init__(self):
+        self.text = ""
+        self.steps = []
+
+        # waiting for "steps": [ -> reading the array -> array closed
+        self.state = "before_steps"
+        self.pos = 0
+
+        # inside the array: how deep we are in {} and [], and where
+        # the current step object started
+        self.depth = 0
+        self.step_start = None
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        """Add more of the reply. Returns the steps that were completed by it."""
+        self.text = self.text + text
+        new_steps = []
+
+        if self.state == "before_steps":
+            match = STEPS_START.search(self.text)
+            if match is None:
+                return new_steps
+            self.state = "in_steps"
+            self.pos = match.end()
+
+        while self.state == "in_steps" and self.pos < len(self.text):
+            char = self.text[self.pos]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{" or char == "[":
+                if self.depth == 0 and char == "{":
+                    self.step_start = self.pos
+                self.depth = self.depth + 1
+            elif char == "}" or char == "]":
+                if self.depth == 0 and char == "]":
+                    # the end of the steps array
+                    self.state = "done"
+                else:
+                    self.depth = self.depth - 1
+                    if self.depth == 0 and char == "}" and self.step_start is not None:
+                        step = self._parse_step(self.text[self.step_start:self.pos + 1])
+                        if step is not None:
+                            self.steps.append(step)
+                            new_steps.append(step)
+                        self.step_start = None
+
+            self.pos = self.pos + 1
+
+        return new_steps
+
+    def is_done(self):
+        """True once the steps array has been closed."""
+        return self.state == "done"
+
+    def _parse_step(self, text):
+        try:
+            step = json.loads(text)
+        except ValueError:
+            print("Skipping a step the AI wrote badly: " + text[:80])
+            return None
+
+        if not isinstance(step, dict):
+            return None
+        return step
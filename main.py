@@ -233,7 +233,9 @@ def render_animation(plan, quality):
         return False
 
 
-def batch_mode(prompt, quality="hd"):
+def batch_mode(prompt, quality="hd", draft=False):
+    # with draft=True a quick preview render comes first, so there is
+    # something to look at before the slower quality finishes
 
     print("\n" + "="*70)
     print("  batch mode - animation generator")
@@ -256,5 +258,12 @@ def batch_mode(prompt, quality="hd"):
 
     show_animation_summary(actions)
 
+    if draft and quality != "preview":
+        print("\nrendering draft first...")
+        if render_animation(clean_plan, "preview"):
+            print("draft ready, now rendering the full quality version")
+        else:
+            print("draft failed, rendering full quality anyway")
+
     print(f"\nrendering with quality: {quality}")
     return render_animation(clean_plan, quality)
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Cache - finished videos, looked up by what was rendered.
+
+The key is a hash of the normalized plan, the quality and the renderer
+version, so two people asking for the same animation get the same video
+without a second render. Video files are stored once, by the hash of
+their bytes, and hard-linked into each render folder that uses them.
+The least recently used entries are dropped when the cache gets too big.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+
+from validation.normalize import normalize_plan
+
+
+# bump this when a renderer change makes the same plan look different,
+# so old cached videos stop matching
+RENDERER_VERSION = "1"
+
+# default disk quota for cached videos (2 GB)
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def make_cache_key(plan, quality):
+    """Build a stable key for a plan at a quality."""
+    clean_plan = normalize_plan(plan)
+    if clean_plan is None:
+        clean_plan = plan
+
+    text = json.dumps(clean_plan, sort_keys=True, separators=(",", ":"))
+    text = text + "|" + str(quality) + "|" + RENDERER_VERSION
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    """sha256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, dest):
+    """Hard-link source to dest, or copy it if linking isn't possible."""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists():
+        dest.unlink()
+
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class VideoCache:
+    """
+    Maps cache keys to video files on disk.
+    index.json holds {key: {"blob", "size", "last_used"}} and the
+    videos themselves live in objects/<sha256 of the file>.mp4.
+    """
+
+    def __init__(self, folder, max_bytes=None):
+        self.folder = Path(folder)
+        self.objects_folder = self.folder / "objects"
+        self.index_path = self.folder / "index.json"
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+
+        self.objects_folder.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = self._load_index()
+
+    def lookup(self, key):
+        """Return the cached video path for a key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            blob_path = self.objects_folder / (entry["blob"] + ".mp4")
+            if not blob_path.exists():
+                # someone deleted the file under us
+                del self.entries[key]
+                self._save_index()
+                return None
+
+            entry["last_used"] = time.time()
+            self._save_index()
+            return blob_path
+
+    def store(self, key, video_path):
+        """
+        Add a freshly rendered video to the cache.
+        If the same bytes are already stored, video_path is replaced with
+        a link to the stored copy so the data is only on disk once.
+        """
+        video_path = Path(video_path)
+        blob = file_hash(video_path)
+        blob_path = self.objects_folder / (blob + ".mp4")
+
+        with self.lock:
+            if blob_path.exists():
+                link_or_copy(blob_path, video_path)
+            else:
+                link_or_copy(video_path, blob_path)
+
+            self.entries[key] = {
+                "blob": blob,
+                "size": blob_path.stat().st_size,
+                "last_used": time.time(),
+            }
+            self._evict()
+            self._save_index()
+
+        return blob_path
+
+    def place(self, blob_path, dest):
+        """Put a cached video at dest (as a link when possible)."""
+        link_or_copy(blob_path, dest)
+        return Path(dest)
+
+    def total_bytes(self):
+        with self.lock:
+            return self._total_bytes()
+
+    def _total_bytes(self):
+        # count each stored file once, however many keys point at it
+        sizes = {}
+        for entry in self.entries.values():
+            sizes[entry["blob"]] = entry["size"]
+        return sum(sizes.values())
+
+    def _evict(self):
+        """Drop least recently used entries until we're under the quota."""
+        while self._total_bytes() > self.max_bytes and len(self.entries) > 0:
+            oldest_key = min(self.entries, key=lambda k: self.entries[k]["last_used"])
+            blob = self.entries[oldest_key]["blob"]
+            del self.entries[oldest_key]
+
+            # only delete the file once nothing else uses it
+            still_used = False
+            for entry in self.entries.values():
+                if entry["blob"] == blob:
+                    still_used = True
+                    break
+
+            if not still_used:
+                blob_path = self.objects_folder / (blob + ".mp4")
+                if blob_path.exists():
+                    blob_path.unlink()
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return {}
+
+        try:
+            return json.loads(self.index_path.read_text())
+        except Exception as error:
+            print("Video cache index is unreadable, starting empty: " + str(error))
+            return {}
+
+    def _save_index(self):
+        # write to a temp file first so a crash can't leave half an index
+        temp_path = self.index_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(self.entries))
+        os.replace(temp_path, self.index_path)
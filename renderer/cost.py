@@ -0,0 +1,228 @@
+"""
+Cost - how long a render will take.
+
+estimate_cost gives a rough relative cost, used to order the render
+queue so a quick low quality render doesn't wait behind a 4k one.
+
+CostModel predicts wall-clock seconds for a plan at each quality. It
+walks the plan the way the executor will play it (with the fades and
+shifts it adds between steps), adds a fixed setup cost per step type
+(LaTeX compiles for equations, building axes for graphs) and scales the
+video length by how long one second of video takes at that quality.
+Every finished render is written to a history file, and the model keeps
+a per-quality correction so its guesses follow what this machine does.
+"""
+
+import json
+import threading
+from pathlib import Path
+
+from renderer.actions import ActionFactory, total_duration
+
+
+# pixels drawn per second of video at each quality, relative to low
+# (854x480 at 15fps). medium is 720p30, high 1080p60, 4k 2160p60,
+# and the _30fps ones are high and 4k at half the frame rate
+QUALITY_WEIGHTS = {
+    "low": 1.0,
+    "medium": 4.5,
+    "high_30fps": 10.1,
+    "high": 20.2,
+    "4k_30fps": 40.5,
+    "4k": 80.9,
+}
+
+# from cheapest to most expensive
+QUALITY_ORDER = ["low", "medium", "high", "4k"]
+
+# starting guesses, corrected by the render history:
+# seconds of rendering per second of video at each quality
+SECONDS_PER_VIDEO_SECOND = {
+    "low": 0.15,
+    "medium": 0.5,
+    "high_30fps": 1.0,
+    "high": 2.0,
+    "4k_30fps": 3.5,
+    "4k": 7.0,
+}
+
+# seconds spent building each kind of step before any frame is drawn
+SETUP_SECONDS = {
+    "TextAction": 0.3,
+    "EquationAction": 1.5,
+    "GraphAction": 0.8,
+    "ShapeAction": 0.1,
+    "AnimationAction": 0.1,
+    "WaitAction": 0.0,
+}
+
+# starting the scene and writing the file
+BASE_SECONDS = 2.0
+
+# how fast the correction follows new renders (0 = never, 1 = only the last one)
+LEARNING_RATE = 0.2
+
+# only the newest renders are read back from the history file
+MAX_HISTORY = 1000
+
+
+def plan_seconds(plan):
+    """How long the finished video will be, going by the step durations."""
+    try:
+        return total_duration(ActionFactory.create_all(plan))
+    except Exception:
+        # a plan the factory can't read still costs something
+        return 2 * len(plan.get("steps", []))
+
+
+def estimate_cost(plan, quality):
+    """Relative cost of rendering a plan: video seconds times pixels per second."""
+    weight = QUALITY_WEIGHTS.get(quality, QUALITY_WEIGHTS["medium"])
+    return max(plan_seconds(plan), 1) * weight
+
+
+def video_timeline(actions):
+    """
+    Seconds of video the executor plays for a list of actions,
+    including what it adds around them (see ActionExecutor).
+    """
+    seconds = 0
+    on_screen = False
+
+    for action in actions:
+        name = action.__class__.__name__
+
+        if name in ["TextAction", "EquationAction", "ShapeAction"]:
+            # text pushes older objects up first, shapes fade them out
+            if on_screen:
+                seconds = seconds + 0.5
+            seconds = seconds + max(action.duration, 1.5)
+            on_screen = True
+        elif name == "GraphAction":
+            # fades out what's there, then draws the axes and the curve
+            if on_screen:
+                seconds = seconds + 0.5
+            seconds = seconds + max(action.duration, 3)
+            on_screen = True
+        elif name == "WaitAction":
+            seconds = seconds + action.wait_time
+        else:
+            seconds = seconds + action.duration
+
+    # the last frame is held for a second
+    return seconds + 1
+
+
+class CostModel:
+
+    def __init__(self, history_path=None):
+        self.history_path = Path(history_path) if history_path else None
+        self.lock = threading.Lock()
+
+        # actual / predicted for each quality, learned from the history
+        self.corrections = {}
+        self.renders = 0
+
+        if self.history_path is not None:
+            self._load_history()
+
+    def raw_seconds(self, plan, quality):
+        """The prediction before any correction from the history."""
+        try:
+            actions = ActionFactory.create_all(plan)
+        except Exception:
+            actions = []
+
+        setup = BASE_SECONDS
+        for action in actions:
+            setup = setup + SETUP_SECONDS.get(action.__class__.__name__, 0.3)
+
+        rate = SECONDS_PER_VIDEO_SECOND.get(quality, SECONDS_PER_VIDEO_SECOND["medium"])
+        return setup + video_timeline(actions) * rate
+
+    def predict_seconds(self, plan, quality):
+        """How many seconds rendering this plan at this quality should take."""
+        with self.lock:
+            correction = self.corrections.get(quality)
+            # a quality we haven't timed yet borrows from the ones we have
+            if correction is None and len(self.corrections) > 0:
+                correction = sum(self.corrections.values()) / len(self.corrections)
+        if correction is None:
+            correction = 1.0
+        return self.raw_seconds(plan, quality) * correction
+
+    def predict_all(self, plan):
+        """Predicted seconds for every quality, like {"low": 3.1, "medium": 6.0, ...}."""
+        predictions = {}
+        for quality in QUALITY_ORDER:
+            predictions[quality] = round(self.predict_seconds(plan, quality), 1)
+        return predictions
+
+    def pick_quality(self, plan, deadline_seconds, max_quality="4k", wait_seconds=0):
+        """
+        The best quality predicted to finish within deadline_seconds,
+        counting wait_seconds spent in the queue first. Never better
+        than max_quality. Falls back to low when nothing fits.
+        """
+        # a cap we don't know can't be compared, so don't risk going over it
+        if max_quality not in QUALITY_ORDER:
+            max_quality = QUALITY_ORDER[0]
+
+        best = QUALITY_ORDER[0]
+        for quality in QUALITY_ORDER:
+            if wait_seconds + self.predict_seconds(plan, quality) <= deadline_seconds:
+                best = quality
+            if quality == max_quality:
+                break
+        return best
+
+    def record(self, plan, quality, seconds):
+        """Learn from a finished render and add it to the history file."""
+        raw = self.raw_seconds(plan, quality)
+        self._learn(quality, raw, seconds)
+
+        if self.history_path is None:
+            return
+
+        line = json.dumps({"quality": quality, "predicted": round(raw, 3), "seconds": round(seconds, 3)})
+        try:
+            with self.lock:
+                with open(self.history_path, "a") as f:
+                    f.write(line + "\n")
+        except Exception as error:
+            print("Could not save render history: " + str(error))
+
+    def _learn(self, quality, raw, seconds):
+        if raw <= 0 or seconds <= 0:
+            return
+
+        ratio = seconds / raw
+        with self.lock:
+            old = self.corrections.get(quality)
+            if old is None:
+                self.corrections[quality] = ratio
+            else:
+                self.corrections[quality] = old + LEARNING_RATE * (ratio - old)
+            self.renders = self.renders + 1
+
+    def _load_history(self):
+        if not self.history_path.exists():
+            return
+
+        try:
+            lines = self.history_path.read_text().splitlines()
+        except Exception as error:
+            print("Could not read render history: " + str(error))
+            return
+
+        # keep the file from growing forever
+        if len(lines) > MAX_HISTORY:
+            lines = lines[-MAX_HISTORY:]
+            self.history_path.write_text("\n".join(lines) + "\n")
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                self._learn(entry["quality"], entry["predicted"], entry["seconds"])
+            except Exception:
+                continue
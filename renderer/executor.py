@@ -1,7 +1,10 @@
 from manim import *
+import os
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 import io
+from pathlib import Path
 from PIL import Image
 from renderer.actions import (
     TextAction,
@@ -11,6 +14,61 @@ from renderer.actions import (
     AnimationAction,
     GraphAction,
 )
+from renderer.tex_cache import TexCache, install_tex_cache
+from renderer.tex_format import TexFormat
+from renderer.tex_preflight import preflight_equations
+from renderer.geometry_cache import GeometryCache
+from validation.latex_check import equation_route
+
+
+TEX_CACHE_DIR = Path(os.getenv("TEX_CACHE_DIR", "tex_cache"))
+
+# compiled equations and parsed shapes, shared by every render and worker
+# process. Set up by init_caches() in the render workers, None elsewhere
+tex_cache = None
+geometry_cache = None
+
+
+def init_caches():
+    """
+    Set up the tex and geometry caches and point manim's tex_to_svg_file
+    at the tex cache. Render worker processes call this once when they
+    start (see renderer/worker.py); anywhere else text and equations are
+    built the normal way.
+    """
+    global tex_cache, geometry_cache
+
+    if tex_cache is not None:
+        return
+
+    # equations that miss the cache are compiled with the template's preamble
+    # precompiled into a format file (TEX_FORMAT=0 turns that off), optionally
+    # by a latex process started ahead of time (TEX_HOT_SPARE=1)
+    tex_format = None
+    if os.getenv("TEX_FORMAT", "1") == "1":
+        tex_format = TexFormat(TEX_CACHE_DIR / "formats", use_spare=os.getenv("TEX_HOT_SPARE", "0") == "1")
+
+    # TEX_CACHE_MAX_BYTES defaults to 200 MB
+    tex_cache = TexCache(
+        TEX_CACHE_DIR,
+        max_bytes=int(os.getenv("TEX_CACHE_MAX_BYTES", "0")),
+        tex_format=tex_format,
+    )
+    install_tex_cache(tex_cache)
+
+    # so a repeat doesn't parse its SVG again
+    # (GEOMETRY_CACHE_MAX_BYTES defaults to 500 MB)
+    geometry_cache = GeometryCache(
+        Path(os.getenv("GEOMETRY_CACHE_DIR", "geometry_cache")),
+        max_bytes=int(os.getenv("GEOMETRY_CACHE_MAX_BYTES", "0")),
+    )
+
+
+def build_cached(parts, build):
+    """build(), through the geometry cache when there is one."""
+    if geometry_cache is None:
+        return build()
+    return geometry_cache.get_or_build(parts, build)
 
 
 def figure_out_function(func_text):
@@ -77,34 +135,127 @@ class ActionExecutor:
     and actually shows them on screen using Manim.
     """
 
-    def __init__(self, scene):
+    def __init__(self, scene, segment_cache=None, on_progress=None):
         # the manim scene we're drawing on
         self.scene = scene
         # list of things currently on screen
         self.objects_on_screen = []
+        # optional renderer.segment_cache.SegmentCache to reuse step videos
+        self.segment_cache = segment_cache
+        # optional function that gets a progress dict before and after each step
+        self.on_progress = on_progress
 
-    def run_all(self, actions):
-        """Run every action in the list, one by one."""
+    def run_all(self, actions, is_last_segment=True):
+        """
+        Run every action in the list, one by one.
+        When the plan is rendered in pieces (see renderer/parallel.py), every
+        piece but the last ends by clearing the screen, which is what the
+        next piece's first step would have done.
+        """
         done = 0
         total = len(actions)
+        start_time = time.time()
 
         for i in range(total):
             action = actions[i]
             print("Running action " + str(i + 1) + "/" + str(total) + ": " + str(action))
+            self.report_progress("step_started", i, total, action, start_time)
+
+            step_start = time.time()
+            worked = self.run_one(action)
+            if worked:
+                done = done + 1
+            else:
+                print("Action " + str(i + 1) + " failed, skipping it.")
+
+            self.report_progress("step_finished", i, total, action, start_time,
+                                 step_seconds=time.time() - step_start, worked=worked)
+
+        if is_last_segment:
+            # hold the last frame for a second
+            self.scene.wait(1)
+        else:
+            self.clear_screen()
+        print("Done! " + str(done) + "/" + str(total) + " actions worked.")
+        return done
 
+    def run_stream(self, next_action):
+        """
+        Run actions as they arrive. next_action() waits for the next one
+        and returns None when there are no more. Used when the plan is
+        still being written while the video renders (see /api/create).
+        Progress has total_steps None, since nobody knows it yet.
+        """
+        done = 0
+        i = 0
+        start_time = time.time()
+
+        while True:
+            action = next_action()
+            if action is None:
+                break
+
+            print("Running action " + str(i + 1) + ": " + str(action))
+            self.report_progress("step_started", i, None, action, start_time)
+
+            step_start = time.time()
             worked = self.run_one(action)
             if worked:
                 done = done + 1
             else:
                 print("Action " + str(i + 1) + " failed, skipping it.")
 
+            self.report_progress("step_finished", i, None, action, start_time,
+                                 step_seconds=time.time() - step_start, worked=worked)
+            i = i + 1
+
         # hold the last frame for a second
         self.scene.wait(1)
-        print("Done! " + str(done) + "/" + str(total) + " actions worked.")
+        print("Done! " + str(done) + "/" + str(i) + " actions worked.")
         return done
 
+    def report_progress(self, event, index, total, action, start_time, **extra):
+        """Send a progress update to on_progress, if someone is listening."""
+        if self.on_progress is None:
+            return
+
+        elapsed = time.time() - start_time
+        steps_done = index + 1 if event == "step_finished" else index
+
+        # guess the time left from the average time per finished step
+        eta = None
+        if steps_done > 0 and total is not None:
+            eta = elapsed / steps_done * (total - steps_done)
+
+        # the renderer tracks how many seconds of video exist so far
+        video_seconds = getattr(self.scene.renderer, "time", 0)
+
+        progress = {
+            "event": event,
+            "step": index + 1,
+            "total_steps": total,
+            "action_type": type(action).__name__,
+            "frames_rendered": int(video_seconds * config.frame_rate),
+            "elapsed_seconds": round(elapsed, 2),
+            "eta_seconds": round(eta, 2) if eta is not None else None,
+        }
+        for key in extra:
+            value = extra[key]
+            progress[key] = round(value, 2) if isinstance(value, float) else value
+
+        try:
+            self.on_progress(progress)
+        except Exception as error:
+            print("Progress callback failed: " + str(error))
+
     def run_one(self, action):
         """Run a single action. Returns True if it worked, False if not."""
+        if self.segment_cache is not None:
+            return self.segment_cache.run_step(self, action, self.run_action)
+        return self.run_action(action)
+
+    def run_action(self, action):
+        """Draw a single action on the scene. Returns True if it worked."""
         try:
             # check what type of action it is and run the right method
             if isinstance(action, TextAction):
@@ -128,13 +279,25 @@ class ActionExecutor:
             print("Error running action: " + str(error))
             return False
 
+    def clear_screen(self):
+        """Fade out everything on screen."""
+        if len(self.objects_on_screen) > 0:
+            fade_outs = []
+            for obj in self.objects_on_screen:
+                fade_outs.append(FadeOut(obj))
+            self.scene.play(*fade_outs, run_time=0.5)
+            self.objects_on_screen = []
+
     # --- TEXT ---
     def show_text(self, action):
         """Show text on screen."""
-        text = Text(
-            action.content,
-            font_size=action.font_size,
-            color=WHITE,
+        text = build_cached(
+            ["Text", action.content, action.font_size, WHITE],
+            lambda: Text(
+                action.content,
+                font_size=action.font_size,
+                color=WHITE,
+            ),
         )
 
         # if there's stuff already on screen, push it up
@@ -158,20 +321,34 @@ class ActionExecutor:
         """Show a math equation on screen."""
         equation = None
 
+        # a quick check decides whether latex has a chance with this
+        route = equation_route(action.content)
+
         # try using MathTex first (needs LaTeX installed)
-        try:
-            equation = MathTex(
-                action.content,
-                font_size=action.font_size,
-                color=YELLOW,
-            )
-        except Exception as e:
-            print("MathTex failed, trying fallback: " + str(e))
+        if route == "latex":
+            try:
+                template_key = None
+                if tex_cache is not None:
+                    template_key = tex_cache.make_key("")
+                equation = build_cached(
+                    # the template's key covers a change of preamble
+                    ["MathTex", action.content, action.font_size, YELLOW, template_key],
+                    lambda: MathTex(
+                        action.content,
+                        font_size=action.font_size,
+                        color=YELLOW,
+                    ),
+                )
+            except Exception as e:
+                print("MathTex failed, trying fallback: " + str(e))
+
+        if equation is None and route != "text":
             # try matplotlib as backup
             equation = self.make_equation_image(action.content, action.font_size)
-            if equation is None:
-                # last resort: just show it as plain text
-                equation = Text(action.content, font_size=action.font_size, color=YELLOW)
+
+        if equation is None:
+            # last resort: just show it as plain text
+            equation = Text(action.content, font_size=action.font_size, color=YELLOW)
 
         # push existing stuff up
         if len(self.objects_on_screen) > 0:
@@ -242,12 +419,7 @@ class ActionExecutor:
         shape.set_stroke(width=action.stroke_width)
 
         # clear the screen first so the shape has room
-        if len(self.objects_on_screen) > 0:
-            fade_outs = []
-            for obj in self.objects_on_screen:
-                fade_outs.append(FadeOut(obj))
-            self.scene.play(*fade_outs, run_time=0.5)
-            self.objects_on_screen = []
+        self.clear_screen()
 
         shape.move_to(ORIGIN)
         self.scene.play(Create(shape), run_time=1.5)
@@ -305,12 +477,7 @@ class ActionExecutor:
     def show_graph(self, action):
         """Plot a mathematical function."""
         # clear screen for the graph
-        if len(self.objects_on_screen) > 0:
-            fade_outs = []
-            for obj in self.objects_on_screen:
-                fade_outs.append(FadeOut(obj))
-            self.scene.play(*fade_outs, run_time=0.5)
-            self.objects_on_screen = []
+        self.clear_screen()
 
         # create the axes (the x and y lines)
         axes = Axes(
@@ -344,10 +511,26 @@ class ActionExecutor:
 
 # --- helper functions that other files use ---
 
-def execute_actions(scene, actions):
+def execute_actions(scene, actions, segment_cache=None, is_last_segment=True,
+                    on_progress=None):
     """Create an executor and run all actions."""
-    executor = ActionExecutor(scene)
-    executor.run_all(actions)
+    # compile every equation up front, all at once, so the render
+    # never stops to wait for latex
+    if tex_cache is not None:
+        try:
+            preflight_equations(actions, tex_cache)
+        except Exception as error:
+            print("Equation preflight failed: " + str(error))
+
+    executor = ActionExecutor(scene, segment_cache=segment_cache, on_progress=on_progress)
+    executor.run_all(actions, is_last_segment=is_last_segment)
+    return executor
+
+
+def execute_stream(scene, next_action, segment_cache=None, on_progress=None):
+    """Create an executor and run actions as next_action() hands them over."""
+    executor = ActionExecutor(scene, segment_cache=segment_cache, on_progress=on_progress)
+    executor.run_stream(next_action)
     return executor
 
 
@@ -0,0 +1,94 @@
+"""
+FFmpeg - small helpers for joining and re-packaging mp4 files.
+None of these re-encode video, they only copy the streams.
+"""
+
+import os
+import subprocess
+from pathlib import Path
+
+
+# moov atom at the front, so players can start before the whole file is loaded
+FASTSTART_FLAGS = "+faststart"
+
+# a header up front and self-contained fragments after it, so a file that
+# is still growing (or only partly downloaded) can already be played
+FRAGMENTED_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+
+def run_ffmpeg(args, timeout=120):
+    """
+    Run ffmpeg with the given arguments.
+    Returns an error message, or None if it worked.
+    """
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"] + args
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except Exception as error:
+        return str(error)
+
+    if result.returncode != 0:
+        return result.stderr.strip()
+    return None
+
+
+def concat_videos(video_paths, output_path, movflags=FASTSTART_FLAGS):
+    """
+    Join mp4 files end to end without re-encoding.
+    The result is written next to output_path first and moved into place
+    at the end, so readers never see half a file.
+    Returns an error message, or None if it worked.
+    """
+    output_path = Path(output_path)
+    list_path = output_path.with_suffix(".txt")
+    temp_path = output_path.with_name(output_path.stem + ".tmp" + output_path.suffix)
+
+    lines = []
+    for path in video_paths:
+        lines.append("file '" + str(Path(path).resolve()) + "'")
+    list_path.write_text("\n".join(lines) + "\n")
+
+    try:
+        error = run_ffmpeg([
+            "-f", "concat", "-safe", "0",
+            "-i", str(list_path),
+            "-c", "copy",
+            "-movflags", movflags,
+            str(temp_path),
+        ])
+    finally:
+        if list_path.exists():
+            list_path.unlink()
+
+    if error is not None:
+        if temp_path.exists():
+            temp_path.unlink()
+        return "Could not join video segments: " + error
+
+    os.replace(temp_path, output_path)
+    return None
+
+
+def make_faststart(video_path):
+    """
+    Move the mp4 index to the front of the file, in place.
+    Returns an error message, or None if it worked.
+    """
+    video_path = Path(video_path)
+    temp_path = video_path.with_name(video_path.stem + ".tmp" + video_path.suffix)
+
+    error = run_ffmpeg([
+        "-i", str(video_path),
+        "-c", "copy",
+        "-movflags", FASTSTART_FLAGS,
+        str(temp_path),
+    ])
+
+    if error is not None:
+        if temp_path.exists():
+            temp_path.unlink()
+        return "Could not move the mp4 index to the front: " + error
+
+    os.replace(temp_path, video_path)
+    return None
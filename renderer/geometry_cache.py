@@ -0,0 +1,194 @@
+"""
+Geometry cache - skip parsing SVGs for text and equations seen before.
+
+Even when latex isn't run again (see renderer/tex_cache.py), building a
+MathTex still parses its SVG into paths, and a Text goes through pango
+and an SVG too. For long equations that parsing is a real part of the
+render. This cache keeps what comes out: every submobject's points and
+colors, and how they nest. It's keyed by what was asked for (content,
+font size, color, template).
+
+Each entry is a folder holding:
+- points.npy: every submobject's points in one float array
+- colors.npy: every submobject's fill, stroke and background rgbas
+- structure.json: per submobject, its parent, its slices of the arrays
+  and its stroke widths
+
+The arrays are memory-mapped when read, so only the parts that are used
+get loaded. The objects are rebuilt as plain VMobjects with the same
+nesting, which is all the executor needs (positioning, Write, FadeOut).
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+from manim import VMobject, __version__ as MANIM_VERSION
+
+
+# default disk quota for cached geometry (500 MB)
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# look at the quota after this many new entries
+EVICT_EVERY = 25
+
+COLOR_FIELDS = ["fill_rgbas", "stroke_rgbas", "background_stroke_rgbas"]
+
+
+class GeometryCache:
+    """
+    Stores the geometry of one mobject in <folder>/<key>/.
+    Safe to share between worker processes: entries are written to a
+    temp folder and renamed into place in one step.
+    """
+
+    def __init__(self, folder, max_bytes=None):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def make_key(self, parts):
+        text = json.dumps([MANIM_VERSION] + list(parts), sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_or_build(self, parts, build):
+        """
+        The mobject for parts (a list describing it), rebuilt from the
+        cache, or made with build() and stored for next time.
+        """
+        key = self.make_key(parts)
+
+        mob = self.load(key)
+        if mob is not None:
+            self.hits = self.hits + 1
+            return mob
+
+        self.misses = self.misses + 1
+        mob = build()
+        try:
+            self.store(key, mob)
+        except Exception as error:
+            print("Could not cache geometry: " + str(error))
+            return mob
+
+        # hand back the rebuilt copy, so a step looks (and hashes, see
+        # renderer/segment_cache.py) the same whether it was cached or not
+        return self.load(key) or mob
+
+    def load(self, key):
+        """Rebuild the cached mobject for a key, or return None."""
+        entry = self.folder / key
+        # another worker can evict the entry at any point while we read it
+        # (the mmapped arrays are only read when sliced), so any OSError is a miss
+        try:
+            structure = json.loads((entry / "structure.json").read_text())
+            points = np.load(entry / "points.npy", mmap_mode="r")
+            colors = np.load(entry / "colors.npy", mmap_mode="r")
+
+            mobs = []
+            for node in structure:
+                mob = VMobject()
+                start, end = node["points"]
+                mob.points = np.array(points[start:end], dtype=float)
+
+                for name in COLOR_FIELDS:
+                    start, end = node[name]
+                    setattr(mob, name, np.array(colors[start:end], dtype=float))
+
+                mob.stroke_width = node["stroke_width"]
+                mob.background_stroke_width = node["background_stroke_width"]
+
+                if node["parent"] is not None:
+                    mobs[node["parent"]].add(mob)
+                mobs.append(mob)
+
+            # mark it as recently used
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return mobs[0]
+
+    def store(self, key, mob):
+        entry = self.folder / key
+        if entry.exists():
+            return
+
+        # walk the family in order, noting each submobject's parent
+        nodes = []
+        points = []
+        colors = []
+        point_count = 0
+        color_count = 0
+
+        queue = [(mob, None)]
+        while len(queue) > 0:
+            part, parent = queue.pop(0)
+            node = {"parent": parent}
+
+            part_points = np.asarray(part.points, dtype=float).reshape(-1, 3)
+            node["points"] = [point_count, point_count + len(part_points)]
+            point_count = point_count + len(part_points)
+            points.append(part_points)
+
+            for name in COLOR_FIELDS:
+                rgbas = np.asarray(getattr(part, name, np.zeros((0, 4))), dtype=float).reshape(-1, 4)
+                node[name] = [color_count, color_count + len(rgbas)]
+                color_count = color_count + len(rgbas)
+                colors.append(rgbas)
+
+            node["stroke_width"] = float(getattr(part, "stroke_width", 0))
+            node["background_stroke_width"] = float(getattr(part, "background_stroke_width", 0))
+
+            index = len(nodes)
+            nodes.append(node)
+            for child in part.submobjects:
+                queue.append((child, index))
+
+        temp_entry = self.folder / (key + ".tmp" + str(os.getpid()))
+        temp_entry.mkdir(parents=True, exist_ok=True)
+        np.save(temp_entry / "points.npy", np.concatenate(points).astype(np.float32))
+        np.save(temp_entry / "colors.npy", np.concatenate(colors).astype(np.float32))
+        (temp_entry / "structure.json").write_text(json.dumps(nodes))
+
+        try:
+            os.rename(temp_entry, entry)
+        except OSError:
+            # another worker stored the same mobject first
+            shutil.rmtree(temp_entry, ignore_errors=True)
+            return
+
+        self.stores = self.stores + 1
+        if self.stores % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until we're under the quota."""
+        entries = []
+        total = 0
+        for entry in self.folder.iterdir():
+            if not entry.is_dir() or ".tmp" in entry.name:
+                continue
+            try:
+                size = 0
+                for f in entry.iterdir():
+                    size = size + f.stat().st_size
+                mtime = entry.stat().st_mtime
+            except OSError:
+                # another worker evicted it first
+                continue
+            entries.append((mtime, size, entry))
+            total = total + size
+
+        entries.sort(key=lambda item: item[0])
+        for mtime, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total = total - size
@@ -0,0 +1,785 @@
+"""
+Jobs - a queue of render jobs drained by a pool of worker threads.
+
+The server puts a job on the queue and returns straight away.
+Each worker thread owns one warm render worker process (see
+renderer/worker.py) and feeds it the next job, so the number of renders
+running at once is the number of workers, not the number of HTTP threads.
+
+Draft jobs are rendered twice: a cheap 480p15 draft first, so there is
+something to watch almost straight away, then the requested quality at a
+lower priority. New work always goes ahead of upgrades.
+
+The queue is bounded and each client may only have a few jobs going at
+once. Within a priority, jobs are ordered by weighted fair queuing: each
+client's jobs get a finish tag of start + cost / weight, where cost is the
+expected render cost (see renderer/cost.py). A client sending lots of work
+only pushes back its own jobs. When a client's turn comes, its cheapest
+waiting job goes first, so a quick render doesn't sit behind that
+client's own 4k one.
+
+When the queue is so deep that new jobs would wait longer than the wait
+SLO, they are rendered a step cheaper (lower frame rate, then lower
+resolution) and marked degraded. Degraded videos are re-rendered at the
+quality that was asked for once nothing else is waiting.
+
+Streamed jobs (submit_stream) start rendering before their plan is
+finished; steps are added with add_step while the video renders.
+"""
+
+import os
+import time
+import uuid
+import queue
+import shutil
+import math
+import itertools
+import threading
+from pathlib import Path
+
+from renderer.cache import make_cache_key
+from renderer.cost import estimate_cost
+
+
+# keep at most this many finished jobs around for status lookups
+MAX_FINISHED_JOBS = 500
+
+# the quality drafts are rendered at (480p, 15fps)
+DRAFT_QUALITY = "low"
+
+# lower numbers are picked up first
+NEW_JOB_PRIORITY = 0
+UPGRADE_PRIORITY = 1
+RERENDER_PRIORITY = 2
+
+# one step cheaper for each quality, when the queue is too deep
+# (see renderer/render.py for the _30fps ones). Nothing drops below medium
+DEGRADE_STEPS = {
+    "4k": "4k_30fps",
+    "4k_30fps": "high",
+    "high": "high_30fps",
+    "high_30fps": "medium",
+}
+
+# new jobs shouldn't wait longer than this before a worker takes them
+DEFAULT_WAIT_SLO = 60
+
+# how many jobs may wait in the queue before new ones are turned away
+DEFAULT_MAX_QUEUED = 100
+
+# how many queued or running jobs one client may have
+DEFAULT_MAX_PER_CLIENT = 4
+
+# guess for how long a render takes until we've timed a few
+DEFAULT_RENDER_SECONDS = 20
+
+
+class RenderJob:
+    """One render request and everything we know about it."""
+
+    def __init__(self, plan, quality, parallel=False, streaming=False, draft=False,
+                 client_id=None):
+        self.id = str(uuid.uuid4())[:8]
+        self.plan = plan
+        self.quality = quality
+        # what the client asked for, quality can be lower while the server is busy
+        self.requested_quality = quality
+        self.degraded = False
+        self.rerendered = False
+        # a re-render is queued or running, so the job's folder must stay
+        self.rerendering = False
+        # who asked for it, for per-client limits and fair queuing
+        self.client_id = client_id
+        # render independent pieces of the plan at the same time
+        self.parallel = parallel
+        # keep a playable video of the part that's done while rendering
+        self.streaming = streaming
+        # render a quick low quality draft before the requested quality
+        self.draft = draft and quality != DRAFT_QUALITY
+        # which render is going on: "draft" first, then "final"
+        self.tier = "draft" if self.draft else "final"
+        # for streamed jobs, steps waiting to be rendered (None = no more)
+        self.step_queue = None
+
+        # queued -> running -> done / failed / cancelled
+        self.status = "queued"
+        self.video_path = None
+        self.partial_video_path = None
+        self.draft_video_path = None
+        self.error = None
+
+        # set when the video came from the cache instead of a render
+        self.cache_key = None
+        self.cached = False
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        # the process rendering this job (set by the render worker)
+        self.process = None
+        self.cancel_requested = False
+
+        # how many requests are waiting on this job (identical requests share it)
+        self.watchers = 1
+
+        # progress dicts from the renderer, oldest first
+        self.events = []
+        self.progress = None
+
+    def add_progress(self, progress):
+        """Record a progress update from the renderer."""
+        progress["time"] = time.time()
+        if self.draft:
+            progress["tier"] = self.tier
+        self.events.append(progress)
+
+        if "draft_video" in progress:
+            self.draft_video_path = Path(progress["draft_video"])
+        if "partial_video" in progress:
+            self.partial_video_path = Path(progress["partial_video"])
+        if "step" in progress:
+            self.progress = progress
+
+    def add_step(self, step):
+        """Add a step to a streamed job's plan, it is rendered when its turn comes."""
+        self.plan["steps"].append(step)
+        self.step_queue.put(step)
+
+    def end_steps(self):
+        """Tell a streamed job that its plan is complete."""
+        self.step_queue.put(None)
+
+    def is_finished(self):
+        return self.status in ["done", "failed", "cancelled"]
+
+    def stopped_status(self):
+        """What a stopped job ends up as: failed if it was stopped by an error."""
+        if self.error is not None:
+            return "failed"
+        return "cancelled"
+
+    def cancel(self):
+        """Stop the job. Kills the render process if it is already running."""
+        self.cancel_requested = True
+        process = self.process
+        if process is not None:
+            try:
+                process.kill()
+            except Exception:
+                pass
+
+    def to_dict(self):
+        info = {
+            "job_id": self.id,
+            "status": self.status,
+            "quality": self.quality,
+            "cached": self.cached,
+            "tier": self.tier,
+            "degraded": self.degraded,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+        if self.degraded:
+            info["requested_quality"] = self.requested_quality
+            info["rerendered"] = self.rerendered
+
+        if self.progress is not None:
+            info["progress"] = self.progress
+
+        if self.video_path is not None:
+            info["video_url"] = "/api/video/" + self.id + "/" + self.video_path.name
+        elif self.partial_video_path is not None:
+            info["partial_video_url"] = "/api/video/" + self.id + "/" + self.partial_video_path.name
+
+        # the draft stays available after the final video replaces it
+        if self.draft_video_path is not None:
+            info["draft_video_url"] = "/api/video/" + self.id + "/" + self.draft_video_path.name
+
+        if self.error is not None:
+            info["error"] = self.error
+
+        return info
+
+
+class RenderQueue:
+    """
+    Holds render jobs and runs them on a fixed number of worker threads.
+    make_worker() is called once per thread and must return something
+    with start() and render(plan, quality, output_dir, job) like
+    renderer.worker.RenderWorker.
+
+    If a cache (renderer.cache.VideoCache) is given, plans that were
+    rendered before are answered from it without a render.
+    If a segment_pool (renderer.parallel.SegmentPool) is given, jobs
+    submitted with parallel=True are rendered piece by piece on it.
+    If a video_index (renderer.video_index.VideoIndex) is given, every
+    finished video is recorded in it.
+
+    Pending work is a priority queue of turns, (priority, finish tag,
+    order, client id), plus each client's waiting (cost, order, job, tier)
+    per priority. A turn is given to the client's cheapest waiting job.
+    A draft job goes on once for its draft and again, behind every new
+    job, for the requested quality.
+
+    client_weights maps client ids to their share of the workers
+    (default 1). A client with weight 2 gets twice the render time of a
+    client with weight 1 when both have work waiting.
+
+    If a cost_model (renderer.cost.CostModel) is given, it prices jobs
+    for fair queuing and learns from every render that finishes.
+
+    wait_slo is the queue wait (seconds) new jobs should stay under; each
+    multiple of it the expected wait goes over costs one DEGRADE_STEPS step.
+    """
+
+    def __init__(self, make_worker, output_folder, workers=None, cache=None,
+                 segment_pool=None, video_index=None, max_queued=None,
+                 max_per_client=None, client_weights=None, cost_model=None,
+                 wait_slo=None):
+        self.make_worker = make_worker
+        self.output_folder = output_folder
+        self.cache = cache
+        self.segment_pool = segment_pool
+        self.video_index = video_index
+
+        self.max_queued = max_queued or DEFAULT_MAX_QUEUED
+        self.max_per_client = max_per_client or DEFAULT_MAX_PER_CLIENT
+        self.client_weights = client_weights or {}
+        self.cost_model = cost_model
+        self.wait_slo = wait_slo or DEFAULT_WAIT_SLO
+
+        # default to one worker per core
+        if not workers:
+            workers = os.cpu_count() or 1
+        self.worker_count = workers
+
+        self.jobs = {}
+        # cache key -> queued or running job, so identical requests share a render
+        self.in_flight = {}
+        # client idempotency key -> job id, so retried POSTs get the same job
+        self.idempotency_keys = {}
+        self.pending = queue.PriorityQueue()
+        # (client id, priority) -> that client's waiting (cost, order, job, tier)
+        self.client_waiting = {}
+        # breaks ties between equal finish tags, first come first served
+        self.order = itertools.count()
+
+        # fair queuing: the finish tag of the job being served, and the
+        # finish tag of each client's last queued job
+        self.virtual_time = 0
+        self.client_finish = {}
+
+        # average render time, for telling rejected clients when to retry
+        self.render_seconds = DEFAULT_RENDER_SECONDS
+        # re-renders on a worker right now; their jobs are already done, but
+        # the workers aren't free
+        self.rerenders_running = 0
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        """Start the worker threads (safe to call more than once)."""
+        if len(self.threads) > 0:
+            return
+
+        for i in range(self.worker_count):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name="render-worker-" + str(i + 1),
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, plan, quality, idempotency_key=None, parallel=False, streaming=False,
+               draft=False, client_id=None, degrade=True):
+        """
+        Put a new job on the queue.
+        Returns two things: the job and an error message. If the queue is
+        full or the client already has too many jobs, the job is None and
+        the error says why (see retry_after for when to try again).
+
+        If an identical job is already queued or running, return that one
+        instead. If the client sent an idempotency key we've seen before,
+        return the job that key started.
+        With draft=True a 480p15 draft is rendered first (see DRAFT_QUALITY).
+        With degrade=False the job is never made cheaper when the queue is deep.
+        """
+        with self.lock:
+            if idempotency_key is not None:
+                job_id = self.idempotency_keys.get(idempotency_key)
+                if job_id in self.jobs:
+                    return self.jobs[job_id], None
+
+        job = RenderJob(plan, quality, parallel=parallel, streaming=streaming, draft=draft,
+                        client_id=client_id)
+        job.cache_key = make_cache_key(plan, quality)
+
+        with self.lock:
+            running_job = self.in_flight.get(job.cache_key)
+            if running_job is not None:
+                running_job.watchers = running_job.watchers + 1
+                if idempotency_key is not None:
+                    self.idempotency_keys[idempotency_key] = running_job.id
+                return running_job, None
+
+            # claim the key now so identical requests attach to this job
+            self.in_flight[job.cache_key] = job
+            self.jobs[job.id] = job
+            if idempotency_key is not None:
+                self.idempotency_keys[idempotency_key] = job.id
+            self._forget_old_jobs()
+
+        if self.cache is not None:
+            self._use_cached_video(job)
+            if job.draft and not job.is_finished():
+                self._use_cached_draft(job)
+
+        if job.is_finished():
+            with self.lock:
+                self._finish_in_flight(job)
+            return job, None
+
+        # cached videos are free, everything else has to fit in the queue
+        with self.lock:
+            error = self._admission_error(job)
+            if error is not None:
+                self._finish_in_flight(job)
+                del self.jobs[job.id]
+                if idempotency_key is not None:
+                    self.idempotency_keys.pop(idempotency_key, None)
+                return None, error
+
+        if degrade:
+            self._degrade_if_busy(job)
+
+        if job.tier == "draft":
+            self._put(job, NEW_JOB_PRIORITY, "draft")
+        elif job.draft:
+            # the draft was cached, only the upgrade is left
+            self._put(job, UPGRADE_PRIORITY, "final")
+        else:
+            self._put(job, NEW_JOB_PRIORITY, "final")
+        return job, None
+
+    def submit_stream(self, quality, client_id=None):
+        """
+        Queue a job whose plan hasn't been written yet. Add its steps
+        with job.add_step and finish with job.end_steps; the render
+        starts as soon as a worker is free and takes steps as they come.
+        Returns two things: the job and an error message, like submit.
+        Nothing is known about the plan yet, so there is no sharing,
+        no cache lookup and no degrading.
+        """
+        job = RenderJob({"steps": []}, quality, client_id=client_id)
+        job.step_queue = queue.Queue()
+
+        with self.lock:
+            error = self._admission_error(job)
+            if error is not None:
+                return None, error
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+
+        self._put(job, NEW_JOB_PRIORITY, "final")
+        return job, None
+
+    def _degrade_if_busy(self, job):
+        """Make the job cheaper if it would wait longer than the wait SLO."""
+        steps = int(self.expected_wait(job) // self.wait_slo)
+
+        quality = job.quality
+        while steps > 0 and quality in DEGRADE_STEPS:
+            quality = DEGRADE_STEPS[quality]
+            steps = steps - 1
+
+        if quality == job.quality:
+            return
+
+        print("Queue is busy, rendering job " + job.id + " at " + quality
+              + " instead of " + job.quality + ".")
+        job.quality = quality
+        job.degraded = True
+
+    def _admission_error(self, job):
+        """Why a new job can't be queued, or None if it can (call with the lock held)."""
+        queued = 0
+        client_jobs = 0
+        for other in self.jobs.values():
+            if other is job or other.is_finished():
+                continue
+            if other.status == "queued":
+                queued = queued + 1
+            if job.client_id is not None and other.client_id == job.client_id:
+                client_jobs = client_jobs + 1
+
+        if queued >= self.max_queued:
+            return "The render queue is full. Please try again in a little while."
+        if client_jobs >= self.max_per_client:
+            return ("You already have " + str(client_jobs) + " renders going. "
+                    + "Wait for one to finish before starting another.")
+        return None
+
+    def expected_wait(self, new_job=None):
+        """
+        Roughly how many seconds a new job will wait before a worker takes it.
+        Pass the job if it is already on the books, so it doesn't count itself.
+        """
+        with self.lock:
+            others = [job for job in self.jobs.values() if job is not new_job]
+            queued = len([job for job in others if job.status == "queued"])
+            running = len([job for job in others if job.status == "running"])
+            # queued re-renders don't count, every new job goes ahead of them
+            running = running + self.rerenders_running
+            if queued + running < self.worker_count:
+                return 0
+            return self.render_seconds * (queued + 1) / self.worker_count
+
+    def retry_after(self):
+        """Roughly how many seconds until the queue has room again."""
+        seconds = max(self.expected_wait(), self.render_seconds / self.worker_count)
+        return min(max(int(math.ceil(seconds)), 1), 300)
+
+    def get(self, job_id):
+        """Find a job by id. Returns None if we don't know it."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id, error=None):
+        """
+        Cancel a job. Queued jobs are skipped when a worker reaches them,
+        running jobs have their render process killed.
+        A job shared by identical requests keeps going until every one
+        of them has cancelled.
+        With error (something the job needed went wrong, like its streamed
+        plan), the job is stopped for everyone and ends up failed instead.
+        Returns the job, or None if we don't know it.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        with self.lock:
+            if job.is_finished():
+                # a done job can still be re-rendering, its video stays as it is
+                if job.rerendering:
+                    job.cancel()
+                return job
+
+            if job.watchers > 1 and error is None:
+                job.watchers = job.watchers - 1
+                return job
+
+            self._finish_in_flight(job)
+            if error is not None:
+                job.error = error
+
+            if job.status == "queued":
+                job.status = job.stopped_status()
+                job.finished_at = time.time()
+
+        job.cancel()
+        return job
+
+    def queued_count(self):
+        return self.pending.qsize()
+
+    def _put(self, job, priority, tier):
+        """Queue one render of a job with its fair queuing finish tag."""
+        quality = job.quality
+        if tier == "draft":
+            quality = DRAFT_QUALITY
+        elif tier == "rerender":
+            quality = job.requested_quality
+        if self.cost_model is not None:
+            cost = self.cost_model.predict_seconds(job.plan, quality)
+        else:
+            cost = estimate_cost(job.plan, quality)
+
+        order = next(self.order)
+        with self.lock:
+            weight = self.client_weights.get(job.client_id, 1)
+            start = max(self.virtual_time, self.client_finish.get(job.client_id, 0))
+            finish = start + cost / weight
+            self.client_finish[job.client_id] = finish
+
+            # clients whose last tag is behind the clock are back to a clean slate
+            if len(self.client_finish) > 1000:
+                for client_id in list(self.client_finish):
+                    if self.client_finish[client_id] <= self.virtual_time:
+                        del self.client_finish[client_id]
+
+            waiting = self.client_waiting.setdefault((job.client_id, priority), [])
+            waiting.append((cost, order, job, tier))
+
+        self.pending.put((priority, finish, order, job.client_id))
+
+    def _worker_loop(self):
+        # start the render process now so it's warm before the first job
+        worker = self.make_worker()
+        worker.start()
+
+        while True:
+            priority, finish, order, client_id = self.pending.get()
+            with self.lock:
+                self.virtual_time = max(self.virtual_time, finish)
+
+                # the turn goes to this client's cheapest waiting job
+                waiting = self.client_waiting[(client_id, priority)]
+                cheapest = min(waiting, key=lambda item: (item[0], item[1]))
+                waiting.remove(cheapest)
+                if len(waiting) == 0:
+                    del self.client_waiting[(client_id, priority)]
+                cost, job_order, job, tier = cheapest
+
+            try:
+                if tier == "draft":
+                    self._run_draft(worker, job)
+                elif tier == "rerender":
+                    self._run_rerender(worker, job)
+                else:
+                    self._run_job(worker, job)
+            except Exception as error:
+                print("Render worker crashed on job " + job.id + ": " + str(error))
+                if tier == "rerender":
+                    # the job still has the video it was done with
+                    continue
+                with self.lock:
+                    self._finish_in_flight(job)
+                job.status = "failed"
+                job.error = "Rendering failed: " + str(error)
+                job.finished_at = time.time()
+            finally:
+                self.pending.task_done()
+
+    def _run_draft(self, worker, job):
+        """Render the draft, then queue the requested quality behind new work."""
+        with self.lock:
+            # it may have been cancelled while it was waiting
+            if job.status != "queued":
+                return
+            job.status = "running"
+            job.started_at = time.time()
+
+        output_dir = self.output_folder / job.id
+        render_started = time.time()
+        video_path, error = worker.render(
+            job.plan, DRAFT_QUALITY, output_dir / "draft", job=job,
+            on_progress=job.add_progress)
+
+        if video_path is None:
+            with self.lock:
+                job.finished_at = time.time()
+                self._finish_in_flight(job)
+                if job.cancel_requested:
+                    job.status = job.stopped_status()
+                else:
+                    job.status = "failed"
+                    job.error = error or "Rendering failed."
+            return
+
+        self._record_render(job.plan, DRAFT_QUALITY, time.time() - render_started)
+
+        # give the draft its own name so it can be served next to the final video
+        draft_path = output_dir / "draft.mp4"
+        os.replace(video_path, draft_path)
+        shutil.rmtree(output_dir / "draft", ignore_errors=True)
+
+        if self.cache is not None:
+            try:
+                self.cache.store(make_cache_key(job.plan, DRAFT_QUALITY), draft_path)
+            except Exception as error:
+                print("Could not cache draft for job " + job.id + ": " + str(error))
+        self._index_video(job, draft_path)
+
+        job.add_progress({"event": "draft_ready", "draft_video": str(draft_path)})
+        with self.lock:
+            if job.cancel_requested:
+                job.status = job.stopped_status()
+                job.finished_at = time.time()
+                return
+            # waiting again, this time for the requested quality
+            job.tier = "final"
+            job.status = "queued"
+        self._put(job, UPGRADE_PRIORITY, "final")
+
+    def _run_job(self, worker, job):
+        with self.lock:
+            # it may have been cancelled while it was waiting
+            if job.status != "queued":
+                return
+            job.status = "running"
+            # drafted jobs keep the time their draft started
+            if job.started_at is None:
+                job.started_at = time.time()
+        render_started = time.time()
+
+        output_dir = self.output_folder / job.id
+        video_path = None
+
+        if job.step_queue is not None:
+            video_path, error = worker.render(
+                job.plan, job.quality, output_dir, job=job,
+                on_progress=job.add_progress, streaming=job.streaming,
+                step_queue=job.step_queue)
+
+        if job.parallel and self.segment_pool is not None:
+            video_path, error = self.segment_pool.render(
+                job.plan, job.quality, output_dir, job=job,
+                on_progress=job.add_progress, streaming=job.streaming)
+            if video_path is None and not job.cancel_requested:
+                print("Parallel render of job " + job.id + " didn't work (" + str(error) + "), rendering it in one piece.")
+
+        if video_path is None and not job.cancel_requested and job.step_queue is None:
+            video_path, error = worker.render(
+                job.plan, job.quality, output_dir, job=job,
+                on_progress=job.add_progress, streaming=job.streaming)
+
+        with self.lock:
+            job.finished_at = time.time()
+            self._finish_in_flight(job)
+
+            # keep a moving average of how long renders take (a streamed
+            # job's time includes waiting for the AI to write its plan)
+            seconds = job.finished_at - render_started
+            if job.step_queue is None:
+                self.render_seconds = 0.8 * self.render_seconds + 0.2 * seconds
+
+            if job.cancel_requested:
+                job.status = job.stopped_status()
+            elif video_path is None:
+                job.status = "failed"
+                job.error = error or "Rendering failed."
+            else:
+                job.status = "done"
+                job.video_path = video_path
+
+        if job.status == "done" and self.cache is not None:
+            try:
+                self.cache.store(make_cache_key(job.plan, job.quality), video_path)
+            except Exception as error:
+                print("Could not cache video for job " + job.id + ": " + str(error))
+
+        if job.status == "done":
+            self._index_video(job, job.video_path)
+            # pieces rendered side by side, or streamed steps that waited on
+            # the AI, would teach the model the wrong speed
+            if not job.parallel and job.step_queue is None:
+                self._record_render(job.plan, job.quality, seconds)
+
+        # redo it properly once nothing else is waiting
+        if job.status == "done" and job.degraded:
+            job.rerendering = True
+            self._put(job, RERENDER_PRIORITY, "rerender")
+
+    def _run_rerender(self, worker, job):
+        """Render a degraded job again at the quality that was asked for."""
+        with self.lock:
+            self.rerenders_running = self.rerenders_running + 1
+        try:
+            self._rerender(worker, job)
+        finally:
+            job.rerendering = False
+            with self.lock:
+                self.rerenders_running = self.rerenders_running - 1
+
+    def _rerender(self, worker, job):
+        if job.status != "done" or job.rerendered or job.cancel_requested:
+            return
+
+        render_started = time.time()
+        video_path, error = worker.render(
+            job.plan, job.requested_quality, self.output_folder / job.id, job=job)
+        if video_path is None:
+            print("Re-render of job " + job.id + " failed: " + str(error))
+            return
+
+        if self.cache is not None:
+            try:
+                self.cache.store(make_cache_key(job.plan, job.requested_quality), video_path)
+            except Exception as error:
+                print("Could not cache video for job " + job.id + ": " + str(error))
+        self._record_render(job.plan, job.requested_quality, time.time() - render_started)
+
+        # the same url now serves the better video
+        with self.lock:
+            job.video_path = video_path
+            job.quality = job.requested_quality
+            job.rerendered = True
+        self._index_video(job, video_path)
+        job.add_progress({"event": "rerendered", "quality": job.quality})
+
+    def _record_render(self, plan, quality, seconds):
+        if self.cost_model is None:
+            return
+        try:
+            self.cost_model.record(plan, quality, seconds)
+        except Exception as error:
+            print("Could not record render time: " + str(error))
+
+    def _index_video(self, job, video_path):
+        if self.video_index is None:
+            return
+        try:
+            self.video_index.add(job.id, video_path)
+        except Exception as error:
+            print("Could not index video for job " + job.id + ": " + str(error))
+
+    def _use_cached_video(self, job):
+        """Finish the job straight away if its video is already cached."""
+        blob_path = self.cache.lookup(job.cache_key)
+        if blob_path is None:
+            return
+
+        try:
+            dest = self.output_folder / job.id / "RenderScene.mp4"
+            job.video_path = self.cache.place(blob_path, dest)
+        except Exception as error:
+            print("Could not use cached video: " + str(error))
+            return
+
+        job.status = "done"
+        job.cached = True
+        job.started_at = job.created_at
+        job.finished_at = time.time()
+        self._index_video(job, job.video_path)
+
+    def _use_cached_draft(self, job):
+        """Skip the draft render if a draft of this plan is already cached."""
+        blob_path = self.cache.lookup(make_cache_key(job.plan, DRAFT_QUALITY))
+        if blob_path is None:
+            return
+
+        try:
+            dest = self.output_folder / job.id / "draft.mp4"
+            job.draft_video_path = self.cache.place(blob_path, dest)
+        except Exception as error:
+            print("Could not use cached draft: " + str(error))
+            return
+
+        job.tier = "final"
+        self._index_video(job, job.draft_video_path)
+
+    def _finish_in_flight(self, job):
+        """Stop sharing a job with new requests (call with the lock held)."""
+        if self.in_flight.get(job.cache_key) is job:
+            del self.in_flight[job.cache_key]
+
+    def _forget_old_jobs(self):
+        """Drop the oldest finished jobs so the dict doesn't grow forever."""
+        finished = [job for job in self.jobs.values() if job.is_finished()]
+        if len(finished) <= MAX_FINISHED_JOBS:
+            return
+
+        finished.sort(key=lambda job: job.finished_at or 0)
+        extra = len(finished) - MAX_FINISHED_JOBS
+        for job in finished[:extra]:
+            del self.jobs[job.id]
+
+        # forget idempotency keys that point at jobs we no longer have
+        for key in list(self.idempotency_keys):
+            if self.idempotency_keys[key] not in self.jobs:
+                del self.idempotency_keys[key]
@@ -0,0 +1,162 @@
+"""
+Parallel - render the independent pieces of a plan at the same time.
+
+Shape and graph steps fade out everything on screen before they draw,
+so nothing on screen carries over across them. That makes them safe
+places to cut a plan. Each piece is rendered in its own worker process
+and the pieces are joined with ffmpeg's concat demuxer, which copies
+the video streams without re-encoding.
+"""
+
+import os
+import queue
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from renderer.worker import RenderWorker
+from renderer.ffmpeg import concat_videos, FRAGMENTED_FLAGS
+
+
+# steps that start by clearing the screen (see ActionExecutor.clear_screen)
+CLEARING_TYPES = ["shape", "graph"]
+
+
+def split_plan(plan):
+    """
+    Cut a plan into pieces that start at screen-clearing steps.
+    Returns a list of plans. A plan with no cut points comes back as one piece.
+    """
+    pieces = []
+    current = []
+
+    for step in plan.get("steps", []):
+        step_type = str(step.get("type", "text")).lower()
+        if step_type in CLEARING_TYPES and len(current) > 0:
+            pieces.append(current)
+            current = []
+        current.append(step)
+
+    if len(current) > 0:
+        pieces.append(current)
+
+    return [{"steps": steps} for steps in pieces]
+
+
+class SegmentPool:
+    """
+    A set of warm render workers used to render the pieces of one plan
+    at the same time. Workers start on first use and stay running.
+    """
+
+    def __init__(self, workers=None):
+        if not workers:
+            workers = os.cpu_count() or 1
+        self.worker_count = workers
+
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for i in range(self.worker_count):
+                worker = RenderWorker()
+                worker.start()
+                self.idle.put(worker)
+            self.started = True
+
+    def render(self, plan, quality, output_dir, job=None, on_progress=None, streaming=False):
+        """
+        Render a plan piece by piece in parallel.
+        Returns two things: the video path and an error message,
+        like RenderWorker.render. Progress dicts get a "segment" number.
+
+        With streaming=True, every time the pieces from the start of the
+        plan are all done they are joined into progressive.mp4, and a
+        "partial_video" progress event says where it is.
+        """
+        pieces = split_plan(plan)
+        output_dir = Path(output_dir)
+
+        # nothing to split, so don't pay for the join
+        if len(pieces) < 2:
+            return None, "Plan has no independent segments."
+
+        self.start()
+
+        finished = {}
+        written = [0]
+        prefix_lock = threading.Lock()
+
+        def piece_done(index, video_path):
+            with prefix_lock:
+                finished[index] = video_path
+
+                # how many pieces from the start are ready
+                ready = 0
+                while ready in finished:
+                    ready = ready + 1
+                if ready <= written[0] or ready == len(pieces):
+                    return
+
+                prefix = [finished[i] for i in range(ready)]
+                partial_path = output_dir / "progressive.mp4"
+                error = concat_videos(prefix, partial_path, movflags=FRAGMENTED_FLAGS)
+                if error is not None:
+                    print(error)
+                    return
+                written[0] = ready
+
+            if on_progress is not None:
+                on_progress({
+                    "event": "partial_video",
+                    "partial_video": str(partial_path),
+                    "segments_ready": ready,
+                    "total_segments": len(pieces),
+                })
+
+        def render_piece(index):
+            def piece_progress(progress):
+                if on_progress is not None:
+                    progress["segment"] = index + 1
+                    progress["total_segments"] = len(pieces)
+                    on_progress(progress)
+
+            worker = self.idle.get()
+            try:
+                video_path, error = worker.render(
+                    pieces[index],
+                    quality,
+                    output_dir / "segments" / str(index),
+                    job=job,
+                    is_last_segment=(index == len(pieces) - 1),
+                    on_progress=piece_progress,
+                )
+            finally:
+                self.idle.put(worker)
+
+            if streaming and video_path is not None:
+                piece_done(index, video_path)
+            return video_path, error
+
+        with ThreadPoolExecutor(max_workers=self.worker_count) as pool:
+            results = list(pool.map(render_piece, range(len(pieces))))
+
+        video_paths = []
+        for video_path, error in results:
+            if video_path is None:
+                return None, error
+            video_paths.append(video_path)
+
+        output_path = output_dir / "RenderScene.mp4"
+        error = concat_videos(video_paths, output_path)
+        if error is not None:
+            return None, error
+
+        # the pieces are inside the final video now
+        shutil.rmtree(output_dir / "segments", ignore_errors=True)
+        return output_path, None
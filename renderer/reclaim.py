@@ -0,0 +1,263 @@
+"""
+Reclaim - keeps rendered_videos and manim's media folders from
+filling the disk.
+
+Every few minutes the reclaimer:
+- deletes manim's partial movie files (and per-render Tex/texts scratch
+  and progressive.mp4 previews) once the final mp4 next to them exists
+- deletes finished renders that are too old, then the oldest ones
+  until the total is under the size quota
+- deletes temp_scene_*.py files left behind by crashed renders
+and reports how many bytes it freed.
+"""
+
+import time
+import shutil
+import threading
+from pathlib import Path
+
+
+# defaults, all can be changed with environment variables (see server.py)
+DEFAULT_MAX_AGE_SECONDS = 72 * 60 * 60
+DEFAULT_MAX_TOTAL_BYTES = 10 * 1024 * 1024 * 1024
+DEFAULT_INTERVAL_SECONDS = 10 * 60
+
+# leave files younger than this alone, something may still be writing them
+GRACE_SECONDS = 10 * 60
+
+# manim's per-render scratch folders, not needed once the video exists
+SCRATCH_FOLDERS = ["Tex", "texts", "images"]
+
+# the in-progress preview, replaced by the final video when the render ends
+PREVIEW_FILE = "progressive.mp4"
+
+
+def folder_size(path, only_unshared=False):
+    """
+    Bytes used by every file under path.
+    With only_unshared=True, hard-linked files (shared with the video
+    cache) are skipped, since deleting one link frees nothing.
+    """
+    path = Path(path)
+    if path.is_file():
+        files = [path]
+    else:
+        files = [f for f in path.rglob("*") if f.is_file()]
+
+    total = 0
+    for f in files:
+        try:
+            stat = f.stat()
+        except OSError:
+            continue
+        if only_unshared and stat.st_nlink > 1:
+            continue
+        total = total + stat.st_size
+    return total
+
+
+def newest_mtime(path):
+    """
+    The latest modification time of path, or of the newest file inside it.
+    An empty folder uses its own time.
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return path.stat().st_mtime
+
+    newest = None
+    for f in path.rglob("*"):
+        if not f.is_file():
+            continue
+        try:
+            mtime = f.stat().st_mtime
+        except OSError:
+            continue
+        if newest is None or mtime > newest:
+            newest = mtime
+
+    if newest is None:
+        newest = path.stat().st_mtime
+    return newest
+
+
+class Reclaimer:
+
+    def __init__(self, videos_folder, media_folder=None, scenes_folder=None,
+                 max_age_seconds=None, max_total_bytes=None, interval_seconds=None,
+                 render_queue=None, video_index=None):
+        self.videos_folder = Path(videos_folder)
+        self.media_folder = Path(media_folder or "media")
+        self.scenes_folder = Path(scenes_folder or ".")
+
+        self.max_age_seconds = max_age_seconds or DEFAULT_MAX_AGE_SECONDS
+        self.max_total_bytes = max_total_bytes or DEFAULT_MAX_TOTAL_BYTES
+        self.interval_seconds = interval_seconds or DEFAULT_INTERVAL_SECONDS
+
+        # used to skip renders that are still going, and to forget deleted ones
+        self.render_queue = render_queue
+        self.video_index = video_index
+
+        self.thread = None
+        self.last_report = None
+        self.total_reclaimed = 0
+
+    def start(self):
+        """Run the reclaimer every interval_seconds in the background."""
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self._loop, name="reclaimer", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as error:
+                print("Reclaimer failed: " + str(error))
+            time.sleep(self.interval_seconds)
+
+    def run_once(self):
+        """Do one cleanup pass. Returns a report of what was freed."""
+        started = time.time()
+
+        report = {
+            "partial_files_bytes": self.delete_finished_partials(),
+            "temp_scenes_bytes": self.delete_orphan_scenes(),
+        }
+        old_bytes, old_count = self.enforce_quotas()
+        report["old_renders_bytes"] = old_bytes
+        report["renders_deleted"] = old_count
+
+        report["reclaimed_bytes"] = (
+            report["partial_files_bytes"]
+            + report["temp_scenes_bytes"]
+            + report["old_renders_bytes"]
+        )
+        report["finished_at"] = time.time()
+        report["seconds"] = round(report["finished_at"] - started, 3)
+
+        self.total_reclaimed = self.total_reclaimed + report["reclaimed_bytes"]
+        report["total_reclaimed_bytes"] = self.total_reclaimed
+        self.last_report = report
+
+        if report["reclaimed_bytes"] > 0:
+            print("Reclaimed " + str(report["reclaimed_bytes"]) + " bytes "
+                  + "(" + str(report["renders_deleted"]) + " old renders deleted)")
+        return report
+
+    def is_running(self, render_id):
+        """True if this render folder belongs to a job that isn't finished or is re-rendering."""
+        if self.render_queue is None:
+            return False
+        job = self.render_queue.get(render_id)
+        return job is not None and (not job.is_finished() or job.rerendering)
+
+    def delete_finished_partials(self):
+        """
+        Delete partial_movie_files/<Scene> folders whose final
+        <Scene>.mp4 exists and is newer than every partial file.
+        """
+        freed = 0
+        now = time.time()
+
+        roots = []
+        for render_dir in self._render_dirs():
+            if not self.is_running(render_dir.name):
+                roots.append(render_dir)
+        if (self.media_folder / "videos").is_dir():
+            roots.append(self.media_folder / "videos")
+
+        for root in roots:
+            for partial_dir in root.rglob("partial_movie_files"):
+                for scene_dir in partial_dir.iterdir():
+                    final_video = partial_dir.parent / (scene_dir.name + ".mp4")
+                    if not scene_dir.is_dir() or not final_video.exists():
+                        continue
+
+                    # a newer partial file means a render is redoing this scene
+                    newest = newest_mtime(scene_dir)
+                    if final_video.stat().st_mtime < newest or now - newest < GRACE_SECONDS:
+                        continue
+
+                    freed = freed + folder_size(scene_dir)
+                    shutil.rmtree(scene_dir, ignore_errors=True)
+
+        # per-render scratch and previews, once the render is done
+        for render_dir in self._render_dirs():
+            if self.is_running(render_dir.name):
+                continue
+            for name in SCRATCH_FOLDERS:
+                scratch = render_dir / name
+                if scratch.is_dir() and now - newest_mtime(scratch) > GRACE_SECONDS:
+                    freed = freed + folder_size(scratch)
+                    shutil.rmtree(scratch, ignore_errors=True)
+
+            preview = render_dir / PREVIEW_FILE
+            if preview.exists() and now - preview.stat().st_mtime > GRACE_SECONDS:
+                freed = freed + preview.stat().st_size
+                preview.unlink()
+
+        return freed
+
+    def delete_orphan_scenes(self):
+        """Delete temp_scene*.py files that no render has touched for a while."""
+        freed = 0
+        now = time.time()
+
+        for scene_file in self.scenes_folder.glob("temp_scene*.py"):
+            try:
+                stat = scene_file.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime < GRACE_SECONDS:
+                continue
+
+            scene_file.unlink()
+            freed = freed + stat.st_size
+
+        return freed
+
+    def enforce_quotas(self):
+        """
+        Delete finished renders older than max_age_seconds, then the oldest
+        ones until everything fits in max_total_bytes.
+        Returns the bytes freed and how many renders were deleted.
+        """
+        now = time.time()
+        renders = []
+        for render_dir in self._render_dirs():
+            if self.is_running(render_dir.name):
+                continue
+            renders.append({
+                "path": render_dir,
+                "mtime": newest_mtime(render_dir),
+                "size": folder_size(render_dir),
+            })
+
+        renders.sort(key=lambda r: r["mtime"])
+        total = sum(r["size"] for r in renders)
+
+        freed = 0
+        deleted = 0
+        for render in renders:
+            too_old = now - render["mtime"] > self.max_age_seconds
+            too_big = total > self.max_total_bytes
+            if not too_old and not too_big:
+                continue
+
+            freed = freed + folder_size(render["path"], only_unshared=True)
+            total = total - render["size"]
+            deleted = deleted + 1
+
+            if self.video_index is not None:
+                self.video_index.remove(render["path"].name)
+            shutil.rmtree(render["path"], ignore_errors=True)
+
+        return freed, deleted
+
+    def _render_dirs(self):
+        if not self.videos_folder.is_dir():
+            return []
+        return [d for d in self.videos_folder.iterdir() if d.is_dir()]
@@ -0,0 +1,195 @@
+"""
+Render - turns a plan into a video file using Manim.
+
+This runs inside a render worker process (see renderer/worker.py),
+so manim is imported once per worker instead of once per video.
+"""
+
+import os
+import traceback
+from pathlib import Path
+
+from manim import Scene, tempconfig
+from renderer.actions import ActionFactory
+from renderer import executor
+from renderer.executor import execute_actions, execute_stream
+from renderer.segment_cache import SegmentCache
+from renderer.ffmpeg import concat_videos, make_faststart, FRAGMENTED_FLAGS
+
+
+# manim quality setting for each quality name
+QUALITY_CONFIGS = {
+    "low": "low_quality",
+    "medium": "medium_quality",
+    "high": "high_quality",
+    "4k": "fourk_quality",
+    # the same sizes at half the frame rate, used when the server is busy
+    "4k_30fps": "fourk_quality",
+    "high_30fps": "high_quality",
+}
+
+# frame rates that differ from the manim quality's own
+FRAME_RATES = {
+    "4k_30fps": 30,
+    "high_30fps": 30,
+}
+
+# video of single steps, shared by every worker process
+# (SEGMENT_CACHE_MAX_BYTES defaults to 1 GB)
+segment_cache = SegmentCache(
+    Path(os.getenv("SEGMENT_CACHE_DIR", "segment_cache")),
+    max_bytes=int(os.getenv("SEGMENT_CACHE_MAX_BYTES", "0")),
+)
+
+
+class RenderScene(Scene):
+    """
+    A scene that draws every step of a plan.
+    With next_step, the steps come one at a time from next_step()
+    (None when there are no more) instead of from the plan.
+    """
+
+    def __init__(self, plan, is_last_segment=True, on_progress=None, next_step=None, **kwargs):
+        super().__init__(**kwargs)
+        self.plan = plan
+        self.is_last_segment = is_last_segment
+        self.on_progress = on_progress
+        self.next_step = next_step
+
+    def construct(self):
+        if self.next_step is not None:
+            execute_stream(
+                self,
+                self.next_action,
+                segment_cache=segment_cache,
+                on_progress=self.on_progress,
+            )
+            return
+
+        actions = ActionFactory.create_all(self.plan)
+        execute_actions(
+            self,
+            actions,
+            segment_cache=segment_cache,
+            is_last_segment=self.is_last_segment,
+            on_progress=self.on_progress,
+        )
+
+    def next_action(self):
+        step = self.next_step()
+        if step is None:
+            return None
+        return ActionFactory.create(step)
+
+
+def render_plan(plan, quality, output_dir, is_last_segment=True, on_progress=None,
+                streaming=False, next_step=None):
+    """
+    Render a plan into a video inside output_dir.
+    Returns two things: the video path and an error message.
+    If it works, error will be None. If it fails, the path will be None.
+
+    is_last_segment is False when the plan is one piece of a bigger plan
+    (see renderer/parallel.py). on_progress gets a dict after every step
+    (see ActionExecutor.report_progress).
+
+    With streaming=True, the steps rendered so far are joined into a
+    fragmented progressive.mp4 after every step, so it can be watched
+    while the rest is still rendering.
+
+    With next_step, the plan's steps arrive one at a time while the video
+    renders (see RenderScene).
+    """
+    settings = {
+        "quality": QUALITY_CONFIGS.get(quality, "medium_quality"),
+        "media_dir": str(output_dir),
+        "format": "mp4",
+        "progress_bar": "none",
+        "verbosity": "WARNING",
+    }
+    if quality in FRAME_RATES:
+        settings["frame_rate"] = FRAME_RATES[quality]
+
+    tex_before = None
+    if executor.tex_cache is not None:
+        tex_before = executor.tex_cache.stats()
+
+    try:
+        with tempconfig(settings):
+            scene = RenderScene(plan, is_last_segment=is_last_segment, on_progress=on_progress,
+                                next_step=next_step)
+            if streaming:
+                scene.on_progress = streaming_progress(scene, output_dir, on_progress)
+            scene.render()
+            video_path = Path(scene.renderer.file_writer.movie_file_path)
+
+        if not video_path.exists():
+            return None, "Rendering completed but no video file was found."
+
+        report_tex_cache(tex_before, on_progress)
+
+        # pieces of a bigger plan get this when they're joined
+        if is_last_segment:
+            error = make_faststart(video_path)
+            if error is not None:
+                print(error)
+
+        return video_path, None
+
+    except Exception as error:
+        # keep the last few lines of the traceback
+        lines = traceback.format_exc().strip().split("\n")
+        short_error = "\n".join(lines[-5:])
+        return None, "Manim rendering failed: " + str(error) + "\n" + short_error
+
+
+def report_tex_cache(before, on_progress):
+    """Tell on_progress how many equations this render found already compiled."""
+    if before is None:
+        return
+    after = executor.tex_cache.stats()
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    if on_progress is None or hits + misses == 0:
+        return
+
+    try:
+        on_progress({"event": "tex_cache", "hits": hits, "misses": misses})
+    except Exception as error:
+        print("Progress callback failed: " + str(error))
+
+
+def streaming_progress(scene, output_dir, on_progress):
+    """
+    Wrap on_progress so every finished step also refreshes progressive.mp4
+    from the partial movie files manim has written so far.
+    """
+    def report(progress):
+        if progress["event"] == "step_finished":
+            files = scene.renderer.file_writer.partial_movie_files
+            files = [f for f in files if f is not None]
+            if len(files) > 0:
+                partial_path = Path(output_dir) / "progressive.mp4"
+                error = concat_videos(files, partial_path, movflags=FRAGMENTED_FLAGS)
+                if error is None:
+                    progress["partial_video"] = str(partial_path)
+                else:
+                    print(error)
+
+        if on_progress is not None:
+            on_progress(progress)
+
+    return report
+
+
+def warm_up():
+    """
+    Load fonts and build one small scene so the first real
+    render doesn't pay for pango and fontconfig setup.
+    """
+    from manim import Text
+
+    try:
+        Text("warm up", font_size=24)
+    except Exception as error:
+        print("Render worker warm up failed: " + str(error))
@@ -0,0 +1,222 @@
+"""
+Segment cache - reuse the video of single steps across renders.
+
+Manim writes one partial movie file per scene.play. Every server render
+has its own media folder though, so manim's own cache never helps a
+different request. This cache keeps the partial files of each step,
+keyed by the step itself, the render settings and a hash of what was
+on screen when the step started. Plans that share a step (the same
+title, the same graph on an empty screen) splice the cached files in
+instead of drawing those frames again.
+"""
+
+import os
+import time
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+from manim import config
+
+from renderer.cache import RENDERER_VERSION
+
+
+# default disk quota for cached segments (1 GB)
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# look at the quota after this many new entries
+EVICT_EVERY = 25
+
+# entries used this recently are never evicted: a render that spliced
+# them in reads them again when ffmpeg joins its partial files, which can
+# be as late as the end of a long render
+EVICT_GRACE_SECONDS = 10 * 60
+
+
+def hash_mobjects(mobjects, digest):
+    """Feed the look of some mobjects (shape, position, colors) into a digest."""
+    for mob in mobjects:
+        for part in mob.get_family():
+            digest.update(type(part).__name__.encode("utf-8"))
+            digest.update(np.round(np.asarray(part.points, dtype=float), 4).tobytes())
+
+            for name in ["fill_rgbas", "stroke_rgbas", "background_stroke_rgbas", "stroke_width"]:
+                value = getattr(part, name, None)
+                if value is not None:
+                    digest.update(np.asarray(value, dtype=float).tobytes())
+
+            # images (like the matplotlib equation fallback)
+            pixels = getattr(part, "pixel_array", None)
+            if pixels is not None:
+                digest.update(np.asarray(pixels).tobytes())
+
+
+def hash_screen_state(executor):
+    """
+    Hash everything that can change how the next step looks:
+    the objects the executor is tracking, in order, plus anything
+    else the scene is still drawing.
+    """
+    digest = hashlib.sha256()
+    hash_mobjects(executor.objects_on_screen, digest)
+
+    digest.update(b"|")
+    tracked = set(id(mob) for mob in executor.objects_on_screen)
+    others = [mob for mob in executor.scene.mobjects if id(mob) not in tracked]
+    hash_mobjects(others, digest)
+
+    return digest.hexdigest()
+
+
+class SegmentCache:
+    """
+    Stores the partial movie files of one step in <folder>/<key>/.
+    Safe to share between worker processes: entries are written to a
+    temp folder and renamed into place in one step.
+    """
+
+    def __init__(self, folder, max_bytes=None):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def make_key(self, executor, action):
+        settings = {
+            "action": action.get_info(),
+            "width": config.pixel_width,
+            "height": config.pixel_height,
+            "fps": config.frame_rate,
+            "background": str(config.background_color),
+            "format": config.format,
+            "version": RENDERER_VERSION,
+        }
+        text = json.dumps(settings, sort_keys=True, default=str)
+        text = text + "|" + hash_screen_state(executor)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def run_step(self, executor, action, run_action):
+        """
+        Run one step through the cache.
+        run_action(action) draws the step and returns True if it worked.
+        """
+        renderer = executor.scene.renderer
+
+        # only the cairo renderer lets us replay a step without drawing it
+        if not hasattr(renderer, "_original_skipping_status"):
+            return run_action(action)
+
+        key = self.make_key(executor, action)
+        file_writer = renderer.file_writer
+
+        cached_files = self.lookup(key)
+        if cached_files is not None:
+            # replay the step without writing frames, so the scene and
+            # objects_on_screen end up exactly where they would be
+            original = renderer._original_skipping_status
+            renderer._original_skipping_status = True
+            renderer.skip_animations = True
+            try:
+                worked = run_action(action)
+            finally:
+                renderer._original_skipping_status = original
+                renderer.skip_animations = original
+
+            file_writer.partial_movie_files.extend(cached_files)
+            self.hits = self.hits + 1
+            return worked
+
+        self.misses = self.misses + 1
+        before = len(file_writer.partial_movie_files)
+        worked = run_action(action)
+
+        new_files = file_writer.partial_movie_files[before:]
+        new_files = [f for f in new_files if f is not None]
+        if worked and len(new_files) > 0:
+            try:
+                self.store(key, new_files)
+            except Exception as error:
+                print("Could not cache step segment: " + str(error))
+
+        return worked
+
+    def lookup(self, key):
+        """Return the cached partial files for a key, or None."""
+        entry = self.folder / key
+        manifest = entry / "files.json"
+        if not manifest.exists():
+            return None
+
+        try:
+            names = json.loads(manifest.read_text())
+        except Exception:
+            return None
+
+        files = [str(entry / name) for name in names]
+        for path in files:
+            if not os.path.exists(path):
+                return None
+
+        # mark it as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        return files
+
+    def store(self, key, files):
+        entry = self.folder / key
+        if entry.exists():
+            return
+
+        temp_entry = self.folder / (key + ".tmp" + str(os.getpid()))
+        temp_entry.mkdir(parents=True, exist_ok=True)
+
+        names = []
+        for i in range(len(files)):
+            name = str(i) + Path(files[i]).suffix
+            shutil.copyfile(files[i], temp_entry / name)
+            names.append(name)
+        (temp_entry / "files.json").write_text(json.dumps(names))
+
+        try:
+            os.rename(temp_entry, entry)
+        except OSError:
+            # another worker stored the same step first
+            shutil.rmtree(temp_entry, ignore_errors=True)
+            return
+
+        self.stores = self.stores + 1
+        if self.stores % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until we're under the quota."""
+        entries = []
+        total = 0
+        for entry in self.folder.iterdir():
+            if not entry.is_dir() or ".tmp" in entry.name:
+                continue
+            try:
+                size = 0
+                for f in entry.iterdir():
+                    size = size + f.stat().st_size
+                mtime = entry.stat().st_mtime
+            except OSError:
+                # another worker evicted it first
+                continue
+            entries.append((mtime, size, entry))
+            total = total + size
+
+        entries.sort(key=lambda item: item[0])
+        now = time.time()
+        for mtime, size, entry in entries:
+            if total <= self.max_bytes or now - mtime < EVICT_GRACE_SECONDS:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total = total - size
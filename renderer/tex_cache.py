@@ -0,0 +1,183 @@
+"""
+Tex cache - compile each LaTeX expression once, not once per render.
+
+Every server render gets its own media folder, so manim's Tex/ folder
+starts empty each time and "a^2 + b^2 = c^2" goes through latex and
+dvisvgm again on every request. This cache keeps the finished SVGs in
+one folder shared by all renders and worker processes, keyed by a hash
+of the full .tex source manim would compile (expression, environment and
+template preamble) and the compiler settings.
+
+install_tex_cache() points manim's tex_to_svg_file at the cache, so
+MathTex and Tex use it without any other changes.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+
+# default disk quota for cached SVGs (200 MB)
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# look at the quota after this many new SVGs
+EVICT_EVERY = 25
+
+# SVGs used this recently are never evicted, another worker may be reading them
+EVICT_GRACE_SECONDS = 60
+
+
+class TexCache:
+    """
+    Stores compiled SVGs as <folder>/<key>.svg.
+    Safe to share between worker processes: each SVG is written to a temp
+    file and moved into place with os.replace, so readers never see half
+    a file.
+    """
+
+    def __init__(self, folder, max_bytes=None, tex_format=None):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # optional renderer.tex_format.TexFormat for quicker compiles on a miss
+        self.tex_format = tex_format
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def make_key(self, expression, environment=None, tex_template=None):
+        tex_template = get_template(tex_template)
+        tex_code = tex_code_for(expression, environment, tex_template)
+
+        text = tex_code + "|" + str(tex_template.tex_compiler) + "|" + str(tex_template.output_format)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return self.folder / (key + ".svg")
+
+    def lookup(self, key):
+        """Return the cached SVG for a key, or None."""
+        path = self.path_for(key)
+        try:
+            # mark it as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, svg_path):
+        """Copy a compiled SVG into the cache. Returns the cached path."""
+        path = self.path_for(key)
+
+        handle, temp_name = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        os.close(handle)
+        try:
+            shutil.copyfile(svg_path, temp_name)
+            os.replace(temp_name, path)
+        except OSError:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+
+        self.stores = self.stores + 1
+        if self.stores % EVICT_EVERY == 0:
+            self.evict()
+        return path
+
+    def evict(self):
+        """Delete least recently used SVGs until we're under the quota."""
+        entries = []
+        total = 0
+        for path in self.folder.glob("*.svg"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total = total + stat.st_size
+
+        entries.sort(key=lambda item: item[0])
+        now = time.time()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes or now - mtime < EVICT_GRACE_SECONDS:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total = total - size
+
+    def tex_to_svg_file(self, expression, environment=None, tex_template=None):
+        """Drop-in for manim's tex_to_svg_file that goes through the cache."""
+        key = self.make_key(expression, environment, tex_template)
+
+        path = self.lookup(key)
+        if path is not None:
+            self.hits = self.hits + 1
+            return path
+
+        self.misses = self.misses + 1
+
+        if self.tex_format is not None:
+            try:
+                path = self.tex_format.tex_to_svg_file(
+                    expression,
+                    environment=environment,
+                    tex_template=tex_template,
+                    store=lambda svg: self.store(key, svg),
+                )
+            except OSError as error:
+                # its SVG is gone with its temp folder, compile it the normal way
+                print("Could not cache compiled equation: " + str(error))
+                path = None
+            if path is not None:
+                return path
+
+        svg_path = original_tex_to_svg_file(expression, environment=environment,
+                                            tex_template=tex_template)
+        try:
+            return self.store(key, svg_path)
+        except OSError as error:
+            print("Could not cache compiled equation: " + str(error))
+            return svg_path
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def get_template(tex_template):
+    from manim import config
+
+    if tex_template is None:
+        return config["tex_template"]
+    return tex_template
+
+
+def tex_code_for(expression, environment, tex_template):
+    """The full .tex document manim writes for an expression."""
+    if environment is not None:
+        return tex_template.get_texcode_for_expression_in_env(expression, environment)
+    return tex_template.get_texcode_for_expression(expression)
+
+
+# manim's own function, kept so the cache can call it on a miss
+original_tex_to_svg_file = None
+
+
+def install_tex_cache(tex_cache):
+    """Make MathTex, Tex and friends get their SVGs through tex_cache."""
+    global original_tex_to_svg_file
+
+    from manim.utils import tex_file_writing
+    from manim.mobject.text import tex_mobject
+
+    if original_tex_to_svg_file is None:
+        original_tex_to_svg_file = tex_file_writing.tex_to_svg_file
+
+    # tex_mobject imported the function by name, so patch both places
+    tex_file_writing.tex_to_svg_file = tex_cache.tex_to_svg_file
+    tex_mobject.tex_to_svg_file = tex_cache.tex_to_svg_file
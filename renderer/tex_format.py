@@ -0,0 +1,253 @@
+"""
+Tex format - compile a single equation without paying for latex startup.
+
+Most of the time latex spends on "E = mc^2" goes to starting up and
+reading the preamble (amsmath, babel and friends), not to typesetting.
+So the preamble of manim's tex template is read once and saved as a
+format file (latex -ini ... \\dump), kept next to the tex cache and found
+through TEXFORMATS. Later compiles load that format and only read the
+\\begin{document} ... \\end{document} part.
+
+With use_spare, a latex process with the format already loaded is
+started ahead of time and sits waiting for its input. A compile hands it
+the file to typeset, and a new spare is started for the next one while
+the SVG is being made.
+
+Anything that goes wrong here returns None and the caller falls back to
+manim's normal compile.
+"""
+
+import os
+import atexit
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+
+# give up on one latex or dvisvgm run after this many seconds
+COMMAND_TIMEOUT = 60
+
+# compilers we know how to build a format for
+FORMAT_COMPILERS = ["latex", "pdflatex", "xelatex"]
+
+
+class TexFormat:
+
+    def __init__(self, folder, use_spare=False):
+        # where the .fmt files go, shared by every worker process
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.use_spare = use_spare
+
+        self.lock = threading.Lock()
+        # format name -> True if it works, False if it couldn't be built
+        self.formats = {}
+        # format name -> (process, folder) of the waiting latex
+        self.spares = {}
+
+        self.env = dict(os.environ)
+        # the trailing separator keeps the default search path too
+        self.env["TEXFORMATS"] = str(self.folder) + os.pathsep
+
+        atexit.register(self.close)
+
+    def tex_to_svg_file(self, expression, environment=None, tex_template=None, store=None):
+        """
+        Compile one expression using the precompiled preamble.
+        store(svg_path) is called with the SVG before its temp folder is
+        removed, and what it returns is returned. None if it didn't work.
+        """
+        from renderer.tex_cache import get_template, tex_code_for
+
+        tex_template = get_template(tex_template)
+        if tex_template.tex_compiler not in FORMAT_COMPILERS:
+            return None
+
+        tex_code = tex_code_for(expression, environment, tex_template)
+        if "\\begin{document}" not in tex_code:
+            return None
+        preamble, body = tex_code.split("\\begin{document}", 1)
+        body = "\\begin{document}" + body
+
+        name = self.get_format(preamble, tex_template)
+        if name is None:
+            return None
+
+        with tempfile.TemporaryDirectory(prefix="tex_format_") as work:
+            work = Path(work)
+            job_file = work / "job.tex"
+            job_file.write_text(body, encoding="utf-8")
+
+            output = None
+            if self.use_spare:
+                output = self.run_spare(name, job_file, tex_template)
+            if output is None:
+                output = self.run_with_format(name, job_file, tex_template)
+            if output is None:
+                return None
+
+            svg = work / "job.svg"
+            command = ["dvisvgm"]
+            if tex_template.output_format == ".pdf":
+                command.append("--pdf")
+            command = command + ["-n", "-v", "0", "-o", str(svg), str(output)]
+            worked = self.run(command, work) and svg.exists()
+
+            # a spare writes into its own folder
+            if output.parent != work:
+                shutil.rmtree(output.parent, ignore_errors=True)
+
+            if not worked:
+                return None
+            return store(svg)
+
+    def get_format(self, preamble, tex_template):
+        """The name of the format for this preamble, building it the first time."""
+        compiler = tex_template.tex_compiler
+        digest = hashlib.sha256((compiler + "|" + preamble).encode("utf-8")).hexdigest()
+        name = "manim-" + digest[:16]
+
+        with self.lock:
+            if name in self.formats:
+                return name if self.formats[name] else None
+
+            # a format left on disk may not load anymore (say after a TeX Live
+            # upgrade), so try it once and build it again if it doesn't
+            works = False
+            if (self.folder / (name + ".fmt")).exists():
+                works = self.format_works(name, tex_template)
+            if not works and self.build_format(name, preamble, compiler):
+                works = self.format_works(name, tex_template)
+
+            self.formats[name] = works
+            if not works:
+                print("Could not build a LaTeX format, equations compile the slow way.")
+                return None
+            return name
+
+    def format_works(self, name, tex_template):
+        """Compile a tiny document with the format, to see that it loads."""
+        with tempfile.TemporaryDirectory(prefix="tex_format_check_") as work:
+            job_file = Path(work) / "job.tex"
+            job_file.write_text("\\begin{document}\nx\n\\end{document}\n", encoding="utf-8")
+            return self.run_with_format(name, job_file, tex_template) is not None
+
+    def build_format(self, name, preamble, compiler):
+        """Read the preamble once with latex -ini and \\dump it to <folder>/<name>.fmt."""
+        with tempfile.TemporaryDirectory(prefix="tex_format_build_") as work:
+            work = Path(work)
+            source = work / (name + ".tex")
+            source.write_text(preamble + "\n\\dump\n", encoding="utf-8")
+
+            # "&latex" starts from the normal latex format, then reads our preamble
+            command = [compiler, "-ini", "-interaction=batchmode", "-halt-on-error",
+                       "-jobname=" + name, "-output-directory=" + str(work),
+                       "&" + compiler, str(source)]
+            if not self.run(command, work):
+                return False
+
+            built = work / (name + ".fmt")
+            if not built.exists():
+                return False
+
+            # another worker may be building the same format, the rename makes that safe
+            # (copied first, the temp folder may be on another disk)
+            temp_path = self.folder / (name + ".fmt.tmp" + str(os.getpid()))
+            shutil.copyfile(built, temp_path)
+            os.replace(temp_path, self.folder / (name + ".fmt"))
+            return True
+
+    def run_with_format(self, name, job_file, tex_template):
+        command = self.latex_command(name, tex_template, job_file.parent, "job") + [str(job_file)]
+        if not self.run(command, job_file.parent):
+            return None
+        return self.find_output(job_file.parent, "job", tex_template)
+
+    def run_spare(self, name, job_file, tex_template):
+        """Hand the job to the waiting latex, and start the next spare."""
+        with self.lock:
+            spare = self.spares.pop(name, None)
+        # start the next one now, it loads while this job runs
+        self.start_spare(name, tex_template)
+
+        if spare is None:
+            return None
+        process, folder = spare
+        if process.poll() is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+            return None
+
+        try:
+            # the spare is waiting at latex's ** prompt for its first line
+            process.communicate(("\\input{" + job_file.as_posix() + "}\n").encode("utf-8"),
+                                timeout=COMMAND_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as error:
+            process.kill()
+            shutil.rmtree(folder, ignore_errors=True)
+            print("LaTeX spare failed: " + str(error))
+            return None
+
+        output = None
+        if process.returncode == 0:
+            output = self.find_output(folder, "spare", tex_template)
+        if output is None:
+            shutil.rmtree(folder, ignore_errors=True)
+        return output
+
+    def start_spare(self, name, tex_template):
+        folder = Path(tempfile.mkdtemp(prefix="tex_spare_"))
+        command = self.latex_command(name, tex_template, folder, "spare")
+        try:
+            process = subprocess.Popen(command, cwd=str(folder), env=self.env,
+                                       stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        except OSError as error:
+            shutil.rmtree(folder, ignore_errors=True)
+            print("Could not start a LaTeX spare: " + str(error))
+            return
+
+        with self.lock:
+            old = self.spares.get(name)
+            self.spares[name] = (process, folder)
+        if old is not None:
+            old[0].kill()
+            shutil.rmtree(old[1], ignore_errors=True)
+
+    def latex_command(self, name, tex_template, folder, jobname):
+        compiler = tex_template.tex_compiler
+        command = [compiler, "-fmt=" + name, "-interaction=batchmode", "-halt-on-error",
+                   "-jobname=" + jobname, "-output-directory=" + str(folder)]
+        if compiler == "xelatex":
+            command.append("-no-pdf")
+        else:
+            command.append("-output-format=" + tex_template.output_format[1:])
+        return command
+
+    def find_output(self, folder, jobname, tex_template):
+        output = folder / (jobname + tex_template.output_format)
+        if not output.exists():
+            return None
+        return output
+
+    def run(self, command, folder):
+        try:
+            result = subprocess.run(command, cwd=str(folder), env=self.env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    timeout=COMMAND_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as error:
+            print(command[0] + " failed: " + str(error))
+            return False
+        return result.returncode == 0
+
+    def close(self):
+        """Stop the waiting spares."""
+        with self.lock:
+            spares = list(self.spares.values())
+            self.spares = {}
+        for process, folder in spares:
+            if process.poll() is None:
+                process.kill()
+            shutil.rmtree(folder, ignore_errors=True)
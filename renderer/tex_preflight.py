@@ -0,0 +1,276 @@
+"""
+Tex preflight - compile all of a plan's equations before rendering starts.
+
+Without this, each equation is compiled when the executor reaches it,
+one after the other, with the render waiting on latex every time. The
+preflight finds every equation in the plan, skips the ones already in
+the tex cache (renderer/tex_cache.py) and compiles the rest at the same
+time, spread over the CPU cores. By the time show_equation runs, its SVG
+is already in the cache.
+
+Expressions are compiled in batches: one latex run typesets several of
+them, each on its own page (using the preview package), and dvisvgm
+splits the pages into SVGs. If a batch fails, for example because one
+expression in it is broken, its expressions are compiled one by one, so
+a bad one only loses itself.
+"""
+
+import os
+import re
+import subprocess
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from renderer.actions import EquationAction
+from renderer.tex_cache import get_template, tex_code_for
+from validation.latex_check import equation_route
+
+
+# latex runs at the same time (0 = one per CPU core)
+PREFLIGHT_WORKERS = int(os.getenv("TEX_PREFLIGHT_WORKERS", "0"))
+
+# most expressions typeset by one latex run (1 turns batching off)
+BATCH_SIZE = int(os.getenv("TEX_PREFLIGHT_BATCH", "8"))
+
+# give up on one latex or dvisvgm run after this many seconds
+COMMAND_TIMEOUT = 60
+
+DOCUMENT_CLASS = re.compile(r"\\documentclass(\[[^\]]*\])?\{standalone\}")
+
+
+class _Collected(Exception):
+    """Stops MathTex right where it would start compiling."""
+
+
+def collect_tex_jobs(contents):
+    """
+    Find out exactly what MathTex would compile for each content string:
+    MathTex is built with manim's tex_to_svg_file swapped for a recorder
+    that notes its arguments and stops. Returns (expression, environment,
+    tex_template) tuples, in order.
+    """
+    from manim import MathTex
+    from manim.utils import tex_file_writing
+    from manim.mobject.text import tex_mobject
+
+    jobs = []
+
+    def record(expression, environment=None, tex_template=None):
+        jobs.append((expression, environment, tex_template))
+        raise _Collected()
+
+    saved = (tex_file_writing.tex_to_svg_file, tex_mobject.tex_to_svg_file)
+    tex_file_writing.tex_to_svg_file = record
+    tex_mobject.tex_to_svg_file = record
+    try:
+        for content in contents:
+            try:
+                MathTex(content)
+            except _Collected:
+                pass
+            except Exception:
+                # it fails before latex too, show_equation will deal with it
+                pass
+    finally:
+        tex_file_writing.tex_to_svg_file, tex_mobject.tex_to_svg_file = saved
+
+    return jobs
+
+
+def preflight_equations(actions, tex_cache, workers=None, batch_size=None):
+    """
+    Compile the equations in actions that aren't in tex_cache yet.
+    Returns how many were compiled.
+    """
+    contents = []
+    for action in actions:
+        if not isinstance(action, EquationAction) or action.content in contents:
+            continue
+        # no point compiling what show_equation won't give to latex
+        if equation_route(action.content) == "latex":
+            contents.append(action.content)
+    if len(contents) == 0:
+        return 0
+
+    try:
+        jobs = collect_tex_jobs(contents)
+    except Exception as error:
+        print("Equation preflight skipped: " + str(error))
+        return 0
+
+    # (key, tex code, template) for each equation that isn't cached yet
+    missing = []
+    keys = set()
+    for expression, environment, tex_template in jobs:
+        tex_template = get_template(tex_template)
+        key = tex_cache.make_key(expression, environment, tex_template)
+        if key in keys or tex_cache.lookup(key) is not None:
+            continue
+        keys.add(key)
+        missing.append((key, tex_code_for(expression, environment, tex_template), tex_template))
+
+    if len(missing) == 0:
+        return 0
+
+    workers = workers or PREFLIGHT_WORKERS or os.cpu_count() or 1
+    batch_size = batch_size or BATCH_SIZE
+
+    # spread the work evenly, but no batch bigger than batch_size
+    per_batch = max(1, min(batch_size, -(-len(missing) // workers)))
+    batches = [missing[i:i + per_batch] for i in range(0, len(missing), per_batch)]
+
+    compiled = 0
+    # latex runs as its own process, so threads are enough to use every core
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        for count in pool.map(lambda batch: compile_batch(batch, tex_cache), batches):
+            compiled = compiled + count
+
+    return compiled
+
+
+def compile_batch(batch, tex_cache):
+    """Compile a batch into tex_cache. Returns how many made it."""
+    with tempfile.TemporaryDirectory(prefix="tex_preflight_") as folder:
+        folder = Path(folder)
+
+        if len(batch) > 1:
+            svgs = compile_together(batch, folder)
+            if svgs is not None:
+                for (key, tex_code, tex_template), svg in zip(batch, svgs):
+                    tex_cache.store(key, svg)
+                return len(batch)
+
+        compiled = 0
+        for i in range(len(batch)):
+            key, tex_code, tex_template = batch[i]
+            svg = compile_one(tex_code, tex_template, folder, "single" + str(i))
+            if svg is not None:
+                tex_cache.store(key, svg)
+                compiled = compiled + 1
+        return compiled
+
+
+def compile_one(tex_code, tex_template, folder, name):
+    """Compile one full .tex document to an SVG, like manim does. Returns its path or None."""
+    tex_file = folder / (name + ".tex")
+    tex_file.write_text(tex_code, encoding="utf-8")
+
+    output = run_tex(tex_file, tex_template)
+    if output is None:
+        return None
+
+    svg = folder / (name + ".svg")
+    if not run_dvisvgm(output, ["-o", str(svg)], tex_template) or not svg.exists():
+        return None
+    return svg
+
+
+def compile_together(batch, folder):
+    """
+    Typeset a whole batch in one latex run, one expression per page.
+    Returns the SVG paths in batch order, or None if it didn't work.
+    """
+    tex_template = batch[0][2]
+    document = batch_document([tex_code for key, tex_code, template in batch])
+    if document is None or tex_template.output_format != ".dvi":
+        return None
+
+    tex_file = folder / "batch.tex"
+    tex_file.write_text(document, encoding="utf-8")
+
+    output = run_tex(tex_file, tex_template)
+    if output is None:
+        return None
+
+    if not run_dvisvgm(output, ["-p", "1-", "-o", str(folder / "page-%p.svg")], tex_template):
+        return None
+
+    svgs = []
+    for i in range(len(batch)):
+        svg = folder / ("page-" + str(i + 1) + ".svg")
+        if not svg.exists():
+            # dvisvgm pads page numbers when there are 10 or more pages
+            svg = folder / ("page-" + str(i + 1).zfill(len(str(len(batch)))) + ".svg")
+        if not svg.exists():
+            return None
+        svgs.append(svg)
+    return svgs
+
+
+def batch_document(tex_codes):
+    """
+    Turn several standalone documents that share a preamble into one
+    document with each body on its own tightly cropped page.
+    Returns None if they can't be combined.
+    """
+    preamble = None
+    bodies = []
+    for tex_code in tex_codes:
+        if "\\begin{document}" not in tex_code or "\\end{document}" not in tex_code:
+            return None
+        head, rest = tex_code.split("\\begin{document}", 1)
+        body = rest.split("\\end{document}", 1)[0]
+
+        if preamble is None:
+            preamble = head
+        elif head != preamble:
+            return None
+        bodies.append(body)
+
+    # standalone's preview option puts the whole document on one page,
+    # the preview package on its own gives every preview environment a page
+    if DOCUMENT_CLASS.search(preamble) is None:
+        return None
+    preamble = DOCUMENT_CLASS.sub(
+        lambda match: "\\documentclass{article}\n\\usepackage[active,tightpage]{preview}",
+        preamble,
+        count=1,
+    )
+
+    pages = []
+    for body in bodies:
+        pages.append("\\begin{preview}" + body + "\\end{preview}")
+
+    return preamble + "\\begin{document}\n" + "\n".join(pages) + "\n\\end{document}\n"
+
+
+def run_tex(tex_file, tex_template):
+    """Run the template's compiler on tex_file. Returns the output file, or None."""
+    compiler = tex_template.tex_compiler
+    output_format = tex_template.output_format
+
+    command = [compiler, "-interaction=batchmode", "-halt-on-error",
+               "-output-directory=" + str(tex_file.parent)]
+    if compiler == "xelatex":
+        command.append("-no-pdf")
+    else:
+        command.append("-output-format=" + output_format[1:])
+    command.append(str(tex_file))
+
+    if not run_command(command, tex_file.parent):
+        return None
+
+    output = tex_file.with_suffix(output_format)
+    if not output.exists():
+        return None
+    return output
+
+
+def run_dvisvgm(output, options, tex_template):
+    command = ["dvisvgm"]
+    if tex_template.output_format == ".pdf":
+        command.append("--pdf")
+    command = command + ["-n", "-v", "0"] + options + [str(output)]
+    return run_command(command, output.parent)
+
+
+def run_command(command, folder):
+    try:
+        result = subprocess.run(command, cwd=str(folder), stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, timeout=COMMAND_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as error:
+        print("Equation preflight: " + command[0] + " failed: " + str(error))
+        return False
+    return result.returncode == 0
+
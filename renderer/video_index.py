@@ -0,0 +1,121 @@
+"""
+Video index - where each render's finished video lives.
+
+Serving a video used to walk the whole render folder with rglob on
+every request. The index is written once when a render finishes and
+answers "render id + file name -> path, size, mtime" with one lookup.
+Small videos that are asked for a lot are also kept in memory.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+
+# keep up to this many bytes of video in memory in total
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+# only videos up to this size are kept in memory
+DEFAULT_MAX_ITEM_BYTES = 4 * 1024 * 1024
+
+
+class VideoIndex:
+
+    def __init__(self, db_path, memory_bytes=None, max_item_bytes=None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS videos ("
+            " render_id TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " PRIMARY KEY (render_id, filename))"
+        )
+        self.conn.commit()
+
+        # (path, mtime_ns) -> bytes, least recently used first
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.memory_bytes = memory_bytes or DEFAULT_MEMORY_BYTES
+        self.max_item_bytes = max_item_bytes or DEFAULT_MAX_ITEM_BYTES
+
+    def add(self, render_id, video_path):
+        """Record a render's finished video."""
+        video_path = Path(video_path)
+        stat = video_path.stat()
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)",
+                (render_id, video_path.name, str(video_path), stat.st_size, stat.st_mtime_ns),
+            )
+            self.conn.commit()
+
+    def lookup(self, render_id, filename):
+        """
+        Find a video. Returns a dict with path, size and mtime_ns,
+        or None if the index doesn't know it.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path, size, mtime_ns FROM videos WHERE render_id = ? AND filename = ?",
+                (render_id, filename),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return {"path": Path(row[0]), "size": row[1], "mtime_ns": row[2]}
+
+    def remove(self, render_id):
+        """Forget every video of a render (when its folder is deleted)."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, mtime_ns FROM videos WHERE render_id = ?", (render_id,)
+            ).fetchall()
+            self.conn.execute("DELETE FROM videos WHERE render_id = ?", (render_id,))
+            self.conn.commit()
+
+            for path, mtime_ns in rows:
+                self._drop_from_memory((path, mtime_ns))
+
+    def read_bytes(self, entry):
+        """
+        The contents of a small video, from memory when we have them.
+        Returns None for videos too big to keep in memory.
+        """
+        if entry["size"] > self.max_item_bytes:
+            return None
+
+        key = (str(entry["path"]), entry["mtime_ns"])
+
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+
+        data = entry["path"].read_bytes()
+
+        with self.lock:
+            if key not in self.memory:
+                self.memory[key] = data
+                self.memory_used = self.memory_used + len(data)
+
+            # make room by dropping the least recently used videos
+            while self.memory_used > self.memory_bytes and len(self.memory) > 0:
+                old_key, old_data = self.memory.popitem(last=False)
+                self.memory_used = self.memory_used - len(old_data)
+
+        return data
+
+    def _drop_from_memory(self, key):
+        data = self.memory.pop(key, None)
+        if data is not None:
+            self.memory_used = self.memory_used - len(data)
@@ -0,0 +1,237 @@
+"""
+Worker - a long-lived process that renders plans.
+
+Starting manim from scratch costs seconds (python, manim, numpy,
+cairo and pango imports, fontconfig). A RenderWorker pays that once
+when it starts, then renders plan after plan in the same process.
+After max_jobs renders the process is replaced with a fresh one so
+leaks don't pile up.
+
+A render can also be started before its plan is finished: the steps are
+then sent down the pipe one by one as ("step", step) and ("end",) when
+there are no more.
+"""
+
+import os
+import time
+import queue
+import multiprocessing
+from pathlib import Path
+
+
+# give up on a render after this many seconds
+RENDER_TIMEOUT = 300
+
+# replace the worker process after this many renders
+MAX_JOBS_PER_WORKER = int(os.getenv("RENDER_WORKER_MAX_JOBS", "50"))
+
+
+def worker_main(conn):
+    """The loop that runs inside the worker process."""
+
+    # the slow imports happen here, once, before any job arrives
+    from renderer.render import render_plan, warm_up
+    from renderer.executor import init_caches
+    init_caches()
+    warm_up()
+    conn.send(("ready",))
+
+    def send_progress(progress):
+        conn.send(("progress", progress))
+
+    def next_step():
+        """Wait for the next step of a plan that is still arriving."""
+        try:
+            message = conn.recv()
+        except EOFError:
+            return None
+        if message[0] == "step":
+            return message[1]
+        return None
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+
+        if message[0] == "stop":
+            break
+
+        if message[0] == "render":
+            job = message[1]
+            step_source = None
+            if job.get("step_stream"):
+                step_source = next_step
+
+            video_path, error = render_plan(
+                job["plan"],
+                job["quality"],
+                job["output_dir"],
+                is_last_segment=job["is_last_segment"],
+                on_progress=send_progress,
+                streaming=job["streaming"],
+                next_step=step_source,
+            )
+            if video_path is not None:
+                video_path = str(video_path)
+            conn.send(("done", video_path, error))
+
+    conn.close()
+
+
+class RenderWorker:
+    """
+    Parent side of one render worker process.
+    Call render() from one thread at a time.
+    """
+
+    def __init__(self, max_jobs=None):
+        self.max_jobs = max_jobs or MAX_JOBS_PER_WORKER
+        self.process = None
+        self.conn = None
+        self.jobs_done = 0
+
+    def start(self):
+        """Start the worker process if it isn't running."""
+        if self.process is not None and self.process.is_alive():
+            return
+
+        # clean up after a process that died on its own
+        if self.conn is not None:
+            self.conn.close()
+
+        # spawn gives every worker a clean interpreter
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+
+        self.process = context.Process(
+            target=worker_main,
+            args=(child_conn,),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        self.conn = parent_conn
+        self.jobs_done = 0
+
+    def stop(self):
+        """Stop the worker process. Kills it if it doesn't stop by itself."""
+        if self.process is None:
+            return
+
+        try:
+            self.conn.send(("stop",))
+        except Exception:
+            pass
+
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def kill(self):
+        """Stop the worker process right now."""
+        if self.process is None:
+            return
+
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def render(self, plan, quality, output_dir, job=None, timeout=RENDER_TIMEOUT,
+               is_last_segment=True, on_progress=None, streaming=False, step_queue=None):
+        """
+        Render a plan in the worker process.
+        Returns two things: the video path and an error message.
+        on_progress is called (in this thread) with each progress dict
+        the worker sends while it renders. streaming=True also keeps a
+        playable progressive.mp4 of the steps done so far.
+
+        If a job is given, the worker process is stored on it so
+        cancelling the job kills the render. The process is restarted
+        on the next call.
+
+        With step_queue (a queue.Queue), plan is ignored and the steps are
+        taken from the queue as they arrive, until a None comes out.
+        """
+        self.start()
+
+        if job is not None:
+            job.process = self.process
+
+        try:
+            self.conn.send(("render", {
+                "plan": plan,
+                "quality": quality,
+                "output_dir": str(output_dir),
+                "is_last_segment": is_last_segment,
+                "streaming": streaming,
+                "step_stream": step_queue is not None,
+            }))
+
+            deadline = time.time() + timeout
+            steps_ended = step_queue is None
+
+            while True:
+                if job is not None and job.cancel_requested:
+                    self.kill()
+                    return None, "Rendering was cancelled."
+
+                if time.time() > deadline:
+                    self.kill()
+                    return None, "Rendering took too long (over 5 minutes)."
+
+                # pass on the steps that have arrived since we last looked
+                while not steps_ended:
+                    try:
+                        step = step_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if step is None:
+                        self.conn.send(("end",))
+                        steps_ended = True
+                    else:
+                        self.conn.send(("step", step))
+
+                if not self.conn.poll(0.2):
+                    continue
+
+                message = self.conn.recv()
+                if message[0] == "done":
+                    break
+
+                if message[0] == "progress" and on_progress is not None:
+                    try:
+                        on_progress(message[1])
+                    except Exception as error:
+                        print("Progress callback failed: " + str(error))
+
+            self.jobs_done = self.jobs_done + 1
+            video_path, error = message[1], message[2]
+
+        except (EOFError, OSError, BrokenPipeError):
+            # the process died (killed by cancel, or crashed)
+            self.kill()
+            if job is not None and job.cancel_requested:
+                return None, "Rendering was cancelled."
+            return None, "Render worker stopped unexpectedly."
+        finally:
+            if job is not None:
+                job.process = None
+
+        # swap in a fresh process once this one has done enough work
+        if self.jobs_done >= self.max_jobs:
+            self.stop()
+            self.start()
+
+        if video_path is None:
+            return None, error
+        return Path(video_path), None
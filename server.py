@@ -5,20 +5,32 @@ Run with: uvicorn server:app --reload
 
 import os
 import json
-import uuid
-import subprocess
+import asyncio
 from pathlib import Path
+from typing import Optional
+from email.utils import formatdate, parsedate_to_datetime
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from llm.planner import get_plan_from_user
-from validation.validate import validate_plan, get_validation_report
-from validation.normalize import normalize_plan
+from llm.planner import get_plan_async, stream_plan_async, system_prompt_version
+from llm.client import LLMClient
+from llm.hedge import HedgedPlanner, parse_backends
+from llm.plan_cache import PlanCache
+from llm.singleflight import AsyncSingleFlight, RecentResults
+from validation.validate import validate_plan, validate_step, get_validation_report
+from validation.normalize import normalize_plan, normalize_step
 from renderer.actions import ActionFactory, actions_summary
+from renderer.worker import RenderWorker
+from renderer.jobs import RenderQueue
+from renderer.parallel import SegmentPool
+from renderer.video_index import VideoIndex
+from renderer.cache import VideoCache
+from renderer.reclaim import Reclaimer
+from renderer.cost import CostModel, QUALITY_ORDER
 
 # load .env file
 load_dotenv()
@@ -30,6 +42,125 @@ app = FastAPI()
 VIDEOS_FOLDER = Path("rendered_videos")
 VIDEOS_FOLDER.mkdir(exist_ok=True)
 
+# finished videos, so the same plan at the same quality is only rendered once
+# (VIDEO_CACHE_MAX_BYTES defaults to 2 GB)
+video_cache = VideoCache(
+    Path("video_cache"),
+    max_bytes=int(os.getenv("VIDEO_CACHE_MAX_BYTES", "0")),
+)
+
+# render id -> finished video, so serving a video doesn't walk the folder
+video_index = VideoIndex(VIDEOS_FOLDER / "index.sqlite3")
+
+# predicts how long a plan takes to render at each quality,
+# learning from the render times saved in render_history.jsonl
+cost_model = CostModel(VIDEOS_FOLDER / "render_history.jsonl")
+
+
+def parse_client_weights(text):
+    """Read "client-a=2,client-b=0.5" into {"client-a": 2.0, "client-b": 0.5}."""
+    weights = {}
+    for part in text.split(","):
+        if "=" not in part:
+            continue
+        client_id, weight = part.split("=", 1)
+        try:
+            weights[client_id.strip()] = float(weight)
+        except ValueError:
+            print("Ignoring bad client weight: " + part)
+    return weights
+
+
+# render jobs wait here until one of the warm render workers picks them up
+# (RENDER_WORKERS defaults to one worker per core). Parallel jobs are split
+# into pieces rendered on a second pool (RENDER_SEGMENT_WORKERS, same default).
+# At most RENDER_QUEUE_MAX jobs wait (default 100) and each client may have
+# RENDER_MAX_PER_CLIENT jobs going (default 4). RENDER_CLIENT_WEIGHTS gives
+# some clients a bigger share of the workers, like "team-a=2,team-b=1"
+# (only those clients are told apart by their X-Client-Id header).
+# New jobs that would wait over RENDER_WAIT_SLO_SECONDS (default 60) are
+# rendered cheaper and re-rendered properly when the queue is quiet
+render_queue = RenderQueue(
+    RenderWorker,
+    VIDEOS_FOLDER,
+    workers=int(os.getenv("RENDER_WORKERS", "0")),
+    cache=video_cache,
+    segment_pool=SegmentPool(workers=int(os.getenv("RENDER_SEGMENT_WORKERS", "0"))),
+    video_index=video_index,
+    max_queued=int(os.getenv("RENDER_QUEUE_MAX", "0")),
+    max_per_client=int(os.getenv("RENDER_MAX_PER_CLIENT", "0")),
+    client_weights=parse_client_weights(os.getenv("RENDER_CLIENT_WEIGHTS", "")),
+    cost_model=cost_model,
+    wait_slo=float(os.getenv("RENDER_WAIT_SLO_SECONDS", "0")),
+)
+
+
+def get_client_id(http_request, x_client_id):
+    """
+    Who a request is from, for per-client limits and fair queuing.
+    X-Client-Id is only believed for clients named in RENDER_CLIENT_WEIGHTS,
+    otherwise anyone could send a new id with every request. Everyone
+    else is told apart by their address.
+    """
+    if x_client_id is not None and x_client_id in render_queue.client_weights:
+        return x_client_id
+    if http_request.client is not None:
+        return http_request.client.host
+    return None
+
+
+# deletes partial movie files, old renders and leftover scene files.
+# Renders older than RETENTION_MAX_AGE_HOURS (default 72) are deleted,
+# then the oldest ones until rendered_videos fits in RETENTION_MAX_BYTES
+# (default 10 GB). Runs every RECLAIM_INTERVAL_SECONDS (default 600)
+reclaimer = Reclaimer(
+    VIDEOS_FOLDER,
+    media_folder=Path("media"),
+    max_age_seconds=int(float(os.getenv("RETENTION_MAX_AGE_HOURS", "0")) * 3600),
+    max_total_bytes=int(os.getenv("RETENTION_MAX_BYTES", "0")),
+    interval_seconds=int(os.getenv("RECLAIM_INTERVAL_SECONDS", "0")),
+    render_queue=render_queue,
+    video_index=video_index,
+)
+
+# AI calls share a pool of kept-alive connections. At most LLM_MAX_CONCURRENCY
+# (default 8) run at once, each may take LLM_TIMEOUT seconds (default 60)
+# and network errors are retried LLM_MAX_RETRIES times (default 3)
+llm_client = LLMClient(
+    timeout=float(os.getenv("LLM_TIMEOUT", "0")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "0")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+)
+
+# LLM_HEDGE_BACKENDS (like "https://a.example/v1|model-a,https://b.example/v1|model-b")
+# adds backends that are also asked when the main one hasn't answered
+# within LLM_HEDGE_DELAY seconds (default 2, 0 asks them all at once)
+hedge_backends = parse_backends(os.getenv("LLM_HEDGE_BACKENDS", ""))
+hedged_planner = None
+if len(hedge_backends) > 0:
+    hedged_planner = HedgedPlanner.from_backends(
+        llm_client,
+        hedge_backends,
+        delay=float(os.getenv("LLM_HEDGE_DELAY", "2")),
+    )
+
+# identical prompts in flight at the same time share one AI call,
+# and retried requests with the same Idempotency-Key get the same answer
+plan_flights = AsyncSingleFlight()
+recent_plans = RecentResults(ttl=600)
+
+# validated plans for earlier prompts, reused for the same or a very
+# similar prompt. Kept PLAN_CACHE_TTL_SECONDS (default a day), at most
+# PLAN_CACHE_MAX_ITEMS (default 1000), and PLAN_CACHE_SIMILARITY (default
+# 0.6) of the words must match for a near-duplicate to count
+plan_cache = PlanCache(
+    system_prompt_version(),
+    ttl=int(os.getenv("PLAN_CACHE_TTL_SECONDS", "0")),
+    max_items=int(os.getenv("PLAN_CACHE_MAX_ITEMS", "0")),
+    similarity=float(os.getenv("PLAN_CACHE_SIMILARITY", "0")),
+    path=VIDEOS_FOLDER / "plan_cache.json",
+)
+
 # serve the frontend files
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 
@@ -39,13 +170,42 @@ app.mount("/static", StaticFiles(directory="frontend"), name="static")
 class GenerateRequest(BaseModel):
     prompt: str
 
+class CreateRequest(BaseModel):
+    prompt: str
+    quality: str = "medium"
+
 class RenderRequest(BaseModel):
     plan: dict
     quality: str = "medium"
+    # render the pieces between screen-clearing steps at the same time
+    parallel: bool = False
+    # keep a playable progressive.mp4 of the part that's done while rendering
+    streaming: bool = False
+    # render a quick 480p15 draft first, then the requested quality
+    draft: bool = False
+    # pick the best quality predicted to be done within this many seconds
+    # (quality, if given too, is the best it may pick)
+    deadline_seconds: Optional[float] = None
 
 
 # --- routes ---
 
+@app.on_event("startup")
+def start_render_workers():
+    """Start the render workers and the reclaimer when the server starts."""
+    render_queue.start()
+    reclaimer.start()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    """Close the AI connections when the server stops."""
+    await llm_client.close()
+    if hedged_planner is not None:
+        for client in hedged_planner.clients:
+            await client.close()
+
+
 @app.get("/")
 def home():
     """Serve the main page."""
@@ -53,9 +213,13 @@ def home():
 
 
 @app.post("/api/generate")
-def generate_plan(request: GenerateRequest):
+async def generate_plan(request: GenerateRequest, idempotency_key: str = Header(None)):
     """
     Take the user's prompt, send it to AI, and return an animation plan.
+    Identical prompts that arrive together share one AI call, and a prompt
+    we already have a plan for (or a very similar one) gets that plan
+    back with "cached": true.
+    While the AI is down the answer is 503 straight away.
     """
     prompt = request.prompt.strip()
 
@@ -65,157 +229,596 @@ def generate_plan(request: GenerateRequest):
             content={"error": "Please enter a prompt."}
         )
 
+    flight_key = " ".join(prompt.split())
+
+    # a retried request gets the answer the first one got
+    if idempotency_key is not None:
+        saved = recent_plans.get(idempotency_key)
+        if saved is not None:
+            saved_prompt, saved_status, saved_content = saved
+            if saved_prompt != flight_key:
+                return JSONResponse(
+                    status_code=422,
+                    content={"error": "This Idempotency-Key was already used for a different prompt."}
+                )
+            return JSONResponse(status_code=saved_status, content=saved_content)
+
+    status_code, content = await plan_flights.do(flight_key, make_plan_response, prompt)
+
+    # server errors (the AI being down, ...) aren't saved, so a retry tries again
+    if idempotency_key is not None and status_code < 500:
+        recent_plans.put(idempotency_key, (flight_key, status_code, content))
+
+    return JSONResponse(status_code=status_code, content=content)
+
+
+async def make_plan_response(prompt):
+    """
+    Run the whole prompt -> plan pipeline.
+    Returns the status code and the JSON body to send back.
+    """
+    # a plan we already have for this prompt (or one like it) skips the AI
+    cached_plan = plan_cache.lookup(prompt)
+    if cached_plan is not None:
+        status_code, content = plan_response(cached_plan)
+        if status_code == 200:
+            content["cached"] = True
+            return status_code, content
+
     # step 1: get plan from AI
-    plan, error = get_plan_from_user(prompt)
+    if hedged_planner is not None:
+        plan, error = await hedged_planner.get_plan(prompt)
+        ai_down = hedged_planner.all_down()
+    else:
+        plan, error = await get_plan_async(prompt, llm_client)
+        ai_down = llm_client.breaker.is_open()
 
     if plan is None:
-        return JSONResponse(
-            status_code=500,
-            content={"error": error or "Failed to generate plan."}
-        )
+        if ai_down:
+            return 503, {"error": error}
+        return 500, {"error": error or "Failed to generate plan."}
+
+    status_code, content = plan_response(plan)
+    if status_code == 200:
+        plan_cache.store(prompt, content["plan"])
+    return status_code, content
 
+
+def plan_response(plan):
+    """
+    Check, clean up and summarize a plan from the AI.
+    Returns the status code and the JSON body to send back.
+    """
     # step 2: validate the plan
     is_valid = validate_plan(plan)
 
     if not is_valid:
         report = get_validation_report(plan)
-        return JSONResponse(
-            status_code=500,
-            content={"error": "AI produced an invalid plan. Please try again.",
-                      "details": report.get("issues", [])}
-        )
+        return 500, {"error": "AI produced an invalid plan. Please try again.",
+                     "details": report.get("issues", [])}
 
     # step 3: normalize (clean up) the plan
     clean_plan = normalize_plan(plan)
 
     if clean_plan is None:
-        return JSONResponse(
-            status_code=500,
-            content={"error": "Could not process the plan. Please try again."}
-        )
+        return 500, {"error": "Could not process the plan. Please try again."}
 
     # step 4: create actions and get summary
     actions = ActionFactory.create_all(clean_plan)
     summary = actions_summary(actions)
 
     # return everything to the frontend
-    return {
+    return 200, {
         "plan": clean_plan,
         "summary": {
             "total_steps": summary["total_actions"],
             "total_duration": summary["total_duration"],
             "types": summary["action_types"],
+            # predicted render seconds at each quality
+            "estimated_render_seconds": cost_model.predict_all(clean_plan),
         }
     }
 
 
-@app.post("/api/render")
-def render_video(request: RenderRequest):
+@app.post("/api/generate/stream")
+async def generate_plan_stream(request: GenerateRequest):
     """
-    Take a plan and render it into a video using Manim.
+    Like /api/generate, but streams the plan as Server-Sent Events while
+    the AI is still writing it. "step" events carry each step once it is
+    checked and cleaned up, "skipped" events the steps that weren't usable,
+    and the stream ends with a "plan" event (the same body /api/generate
+    returns, built from the usable steps) or an "error" event.
     """
-    plan = request.plan
-    quality = request.quality
+    prompt = request.prompt.strip()
 
-    # pick the right manim quality flag
-    quality_flags = {
-        "low": "-ql",
-        "medium": "-qm",
-        "high": "-qh",
-    }
-    flag = quality_flags.get(quality, "-qm")
+    if prompt == "":
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Please enter a prompt."}
+        )
 
-    # create a unique id for this render
-    render_id = str(uuid.uuid4())[:8]
-    scene_file = Path("temp_scene_" + render_id + ".py")
+    return StreamingResponse(
+        stream_plan_events(prompt),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
-    # write the scene file
-    scene_code = '''
-from manim import *
-from renderer.actions import ActionFactory
-from renderer.executor import execute_actions
-import json
 
-class RenderScene(Scene):
-    def construct(self):
-        plan = json.loads("""''' + json.dumps(plan) + '''""")
-        actions = ActionFactory.create_all(plan)
-        execute_actions(self, actions)
-'''
+async def stream_plan_events(prompt):
+    """Yield a plan's steps in SSE format as the AI writes them."""
+    cached_plan = plan_cache.lookup(prompt)
+    if cached_plan is not None:
+        status_code, content = plan_response(cached_plan)
+        if status_code == 200:
+            for index, step in enumerate(content["plan"]["steps"]):
+                yield "event: step\ndata: " + json.dumps({"index": index, "step": step}) + "\n\n"
+            content["cached"] = True
+            yield "event: plan\ndata: " + json.dumps(content) + "\n\n"
+            return
+
+    events = asyncio.Queue()
+    good_steps = []
+
+    def on_step(step):
+        index = len(good_steps)
+        clean_step = clean_streamed_step(step, index)
+        if clean_step is None:
+            events.put_nowait(("skipped", {"step": step}))
+            return
+
+        good_steps.append(step)
+        events.put_nowait(("step", {"index": index, "step": clean_step}))
 
-    scene_file.write_text(scene_code)
+    task = asyncio.ensure_future(stream_plan_async(prompt, llm_client, on_step))
+    task.add_done_callback(lambda done: events.put_nowait(None))
 
     try:
-        # run manim to render the video
-        cmd = [
-            "manim", flag,
-            str(scene_file), "RenderScene",
-            "--format=mp4",
-            "--media_dir", str(VIDEOS_FOLDER / render_id),
-        ]
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=300,
-        )
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield "event: " + event[0] + "\ndata: " + json.dumps(event[1]) + "\n\n"
+
+        plan, error = task.result()
+        if plan is None:
+            yield "event: error\ndata: " + json.dumps({"error": error}) + "\n\n"
+            return
+
+        status_code, content = plan_response({"steps": good_steps})
+        event_name = "plan" if status_code == 200 else "error"
+        if status_code == 200:
+            plan_cache.store(prompt, content["plan"])
+        yield "event: " + event_name + "\ndata: " + json.dumps(content) + "\n\n"
+    finally:
+        # the client went away, stop the AI call
+        if not task.done():
+            task.cancel()
 
-        if result.returncode != 0:
-            error_msg = result.stderr
-            # get the last few lines of the error
-            lines = error_msg.strip().split("\n")
-            short_error = "\n".join(lines[-5:]) if len(lines) > 5 else error_msg
-            return JSONResponse(
-                status_code=500,
-                content={"error": "Manim rendering failed.", "details": short_error}
-            )
 
-        # find the output video file
-        media_dir = VIDEOS_FOLDER / render_id
-        video_files = list(media_dir.rglob("*.mp4"))
+def clean_streamed_step(step, index):
+    """Check and clean up one step from the AI. Returns None if it can't be used."""
+    if not validate_step(step, index):
+        return None
+    return normalize_step(step)
 
-        if len(video_files) == 0:
-            return JSONResponse(
-                status_code=500,
-                content={"error": "Rendering completed but no video file was found."}
-            )
 
-        # get the newest video file
-        video_path = max(video_files, key=lambda f: f.stat().st_mtime)
+# /api/create tasks that are still feeding steps to their render
+plan_feeders = set()
 
-        return {
-            "video_url": "/api/video/" + render_id + "/" + video_path.name,
-            "render_id": render_id,
-        }
 
-    except subprocess.TimeoutExpired:
+@app.post("/api/create")
+async def create_video(request: CreateRequest, http_request: Request,
+                       x_client_id: str = Header(None)):
+    """
+    Prompt to video in one go. The render starts straight away and each
+    step is rendered as soon as the AI has written it, so the AI and the
+    render overlap instead of running one after the other.
+    Returns a render job like /api/render. Its events (see
+    /api/render/{job_id}/events) carry "plan_step" events for each step
+    the AI writes, "plan_ready" with the whole plan, and the usual render
+    progress.
+    """
+    prompt = request.prompt.strip()
+
+    if prompt == "":
         return JSONResponse(
-            status_code=500,
-            content={"error": "Rendering took too long (over 5 minutes)."}
+            status_code=400,
+            content={"error": "Please enter a prompt."}
         )
-    except Exception as error:
+
+    client_id = get_client_id(http_request, x_client_id)
+
+    job, error = render_queue.submit_stream(request.quality, client_id=client_id)
+
+    if job is None:
         return JSONResponse(
-            status_code=500,
-            content={"error": "Rendering failed: " + str(error)}
+            status_code=429,
+            content={"error": error},
+            headers={"Retry-After": str(render_queue.retry_after())},
         )
+
+    task = asyncio.ensure_future(feed_plan_to_job(prompt, job))
+    plan_feeders.add(task)
+    task.add_done_callback(plan_feeders.discard)
+
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+
+async def feed_plan_to_job(prompt, job):
+    """Stream a plan from the AI into a render job, step by step."""
+    good_steps = []
+
+    cached_plan = plan_cache.lookup(prompt)
+    if cached_plan is not None and validate_plan(cached_plan):
+        for index, step in enumerate(cached_plan["steps"]):
+            clean_step = normalize_step(step)
+            good_steps.append(clean_step)
+            job.add_progress({"event": "plan_step", "index": index, "plan_step": clean_step})
+            job.add_step(clean_step)
+        job.end_steps()
+        job.add_progress({"event": "plan_ready", "plan": {"steps": good_steps}, "cached": True})
+        return
+
+    def on_step(step):
+        if job.is_finished():
+            return
+
+        index = len(good_steps)
+        clean_step = clean_streamed_step(step, index)
+        if clean_step is None:
+            job.add_progress({"event": "plan_step_skipped", "plan_step": step})
+            return
+
+        good_steps.append(clean_step)
+        job.add_progress({"event": "plan_step", "index": index, "plan_step": clean_step})
+        job.add_step(clean_step)
+
+    # the render worker waits on the step queue, so however this ends it
+    # must hear about it: the plan is complete, or the job is stopped
+    plan = None
+    error = None
+    try:
+        plan, error = await stream_plan_async(prompt, llm_client, on_step)
+    except Exception as stream_error:
+        print("Streaming the plan for job " + job.id + " failed: " + str(stream_error))
+        error = "AI request failed: " + str(stream_error)
     finally:
-        # clean up the temp file
-        if scene_file.exists():
-            scene_file.unlink()
+        if plan is None or len(good_steps) == 0:
+            render_queue.cancel(job.id, error=error or "AI produced an invalid plan. Please try again.")
+        else:
+            job.end_steps()
+
+    if plan is None or len(good_steps) == 0:
+        return
+
+    job.add_progress({"event": "plan_ready", "plan": {"steps": good_steps}})
+
+    if validate_plan({"steps": good_steps}):
+        plan_cache.store(prompt, {"steps": good_steps})
+
+
+@app.post("/api/render")
+def render_video(request: RenderRequest, http_request: Request,
+                 idempotency_key: str = Header(None), x_client_id: str = Header(None)):
+    """
+    Put a plan on the render queue and return the job id straight away.
+    Poll GET /api/render/{job_id} to find out when the video is ready.
+    Draft jobs show a draft_video_url first and a video_url when the
+    requested quality is done.
+    Identical plans that are already rendering share that job.
+
+    Clients are told apart by their address, or by the X-Client-Id header
+    for clients named in RENDER_CLIENT_WEIGHTS.
+    When the queue is full, or the client has too many renders going,
+    the answer is 429 with a Retry-After header.
+    """
+    client_id = get_client_id(http_request, x_client_id)
+
+    quality = request.quality
+    if request.deadline_seconds is not None:
+        max_quality = "4k"
+        if "quality" in request.model_fields_set:
+            max_quality = request.quality
+        if max_quality not in QUALITY_ORDER:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Unknown quality " + repr(max_quality) + ", use one of: " + ", ".join(QUALITY_ORDER)}
+            )
+        quality = cost_model.pick_quality(
+            request.plan,
+            request.deadline_seconds,
+            max_quality=max_quality,
+            wait_seconds=render_queue.expected_wait(),
+        )
+
+    job, error = render_queue.submit(
+        request.plan,
+        quality,
+        idempotency_key=idempotency_key,
+        parallel=request.parallel,
+        streaming=request.streaming,
+        draft=request.draft,
+        client_id=client_id,
+        # a deadline already picked a quality that fits the queue
+        degrade=request.deadline_seconds is None,
+    )
+
+    if job is None:
+        return JSONResponse(
+            status_code=429,
+            content={"error": error},
+            headers={"Retry-After": str(render_queue.retry_after())},
+        )
+
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+
+@app.get("/api/render/{job_id}")
+def render_status(job_id: str):
+    """Report the status of a render job."""
+    job = render_queue.get(job_id)
+
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Render job not found."})
+
+    return job.to_dict()
+
+
+@app.get("/api/render/{job_id}/events")
+def render_events(job_id: str):
+    """
+    Stream a render job's progress as Server-Sent Events.
+    "progress" events carry one dict per step (see ActionExecutor.report_progress),
+    "status" events carry the job whenever its status changes.
+    The stream ends when the job is finished.
+    """
+    job = render_queue.get(job_id)
+
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Render job not found."})
+
+    return StreamingResponse(
+        stream_job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+async def stream_job_events(job):
+    """Yield a job's events in SSE format until the job is finished."""
+    sent = 0
+    last_state = None
+
+    while True:
+        new_events = job.events[sent:]
+        sent = sent + len(new_events)
+        for progress in new_events:
+            yield "event: progress\ndata: " + json.dumps(progress) + "\n\n"
+
+        # the draft -> final handoff (running, queued, running) can happen
+        # between two checks, so a new tier or draft counts as a change too
+        state = (job.status, job.tier, job.draft_video_path)
+        if state != last_state:
+            last_state = state
+            yield "event: status\ndata: " + json.dumps(job.to_dict()) + "\n\n"
+
+        if job.is_finished():
+            break
+
+        await asyncio.sleep(0.25)
+
+
+@app.delete("/api/render/{job_id}")
+def cancel_render(job_id: str):
+    """Cancel a queued or running render job."""
+    job = render_queue.cancel(job_id)
+
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Render job not found."})
+
+    return job.to_dict()
+
+
+@app.get("/api/storage")
+def storage_report():
+    """What the last cleanup pass freed (see renderer/reclaim.py)."""
+    return {
+        "last_run": reclaimer.last_report,
+        "total_reclaimed_bytes": reclaimer.total_reclaimed,
+        "video_cache_bytes": video_cache.total_bytes(),
+    }
+
+
+@app.post("/api/storage/reclaim")
+def reclaim_storage():
+    """Run a cleanup pass now and report what it freed."""
+    return reclaimer.run_once()
+
+
+@app.get("/api/llm/stats")
+def llm_stats():
+    """Plan cache hits, and how each AI backend is doing when hedging."""
+    hedging = None
+    if hedged_planner is not None:
+        hedging = hedged_planner.stats()
+    return {
+        "plan_cache": plan_cache.stats(),
+        "hedging": hedging,
+    }
 
 
 @app.get("/api/video/{render_id}/{filename}")
-def serve_video(render_id: str, filename: str):
-    """Serve a rendered video file."""
+def serve_video(render_id: str, filename: str, request: Request):
+    """
+    Serve a rendered video file.
+    Supports byte ranges (so players can seek and start early),
+    ETag / Last-Modified and conditional requests.
+    """
+    entry = find_video(render_id, filename)
+
+    if entry is None:
+        return JSONResponse(status_code=404, content={"error": "Video not found."})
+
+    return send_video(request, entry, filename)
+
+
+def find_video(render_id, filename):
+    """
+    Look a video up without walking the render folder.
+    Returns a dict with path, size and mtime_ns, or None.
+    """
+    entry = video_index.lookup(render_id, filename)
+    if entry is not None:
+        return entry
+
+    # the growing preview of a render that's still going
+    job = render_queue.get(render_id)
+    if job is not None and job.partial_video_path is not None:
+        if job.partial_video_path.name == filename and job.partial_video_path.exists():
+            stat = job.partial_video_path.stat()
+            return {"path": job.partial_video_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    # renders from before the index existed: search once, then remember
     media_dir = VIDEOS_FOLDER / render_id
-    video_files = list(media_dir.rglob(filename))
+    if job is not None or not media_dir.is_dir():
+        return None
 
+    video_files = list(media_dir.rglob(filename))
     if len(video_files) == 0:
-        return JSONResponse(status_code=404, content={"error": "Video not found."})
+        return None
+
+    video_index.add(render_id, video_files[0])
+    return video_index.lookup(render_id, filename)
 
-    return FileResponse(
-        str(video_files[0]),
+
+# read videos in chunks of this size when sending part of a file
+VIDEO_CHUNK_SIZE = 256 * 1024
+
+
+def send_video(request, entry, filename):
+    """Build the response for a video file, honoring Range and conditional headers."""
+    video_path = entry["path"]
+    size = entry["size"]
+    mtime = entry["mtime_ns"] / 1e9
+    etag = '"' + format(entry["mtime_ns"], "x") + "-" + format(size, "x") + '"'
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+    }
+
+    # the browser already has this exact file
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+                if int(mtime) <= since:
+                    return Response(status_code=304, headers=headers)
+            except Exception:
+                pass
+
+    byte_range = parse_range(request.headers.get("range"), size)
+
+    # only send part of the file if it hasn't changed since the client
+    # got the first part (progressive.mp4 is replaced while rendering)
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range == "invalid":
+        headers["Content-Range"] = "bytes */" + str(size)
+        return Response(status_code=416, headers=headers)
+
+    # small popular videos are served from memory
+    data = None
+    if filename != "progressive.mp4":
+        try:
+            data = video_index.read_bytes(entry)
+        except OSError:
+            return JSONResponse(status_code=404, content={"error": "Video not found."})
+
+    if byte_range is None:
+        if data is not None:
+            headers["Content-Disposition"] = 'attachment; filename="' + filename + '"'
+            return Response(content=data, media_type="video/mp4", headers=headers)
+
+        return FileResponse(
+            str(video_path),
+            media_type="video/mp4",
+            filename=filename,
+            headers=headers,
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = "bytes " + str(start) + "-" + str(end) + "/" + str(size)
+
+    if data is not None:
+        return Response(
+            content=data[start:end + 1],
+            status_code=206,
+            media_type="video/mp4",
+            headers=headers,
+        )
+
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        read_file_range(video_path, start, end),
+        status_code=206,
         media_type="video/mp4",
-        filename=filename,
+        headers=headers,
     )
+
+
+def parse_range(range_header, size):
+    """
+    Read a "bytes=start-end" Range header.
+    Returns (start, end) with end included, None to send the whole file,
+    or "invalid" if the range can't be satisfied.
+    Only single ranges are supported; anything else gets the whole file.
+    """
+    if range_header is None or not range_header.startswith("bytes="):
+        return None
+
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+
+    first, last = spec.split("-", 1)
+    try:
+        if first == "":
+            # "bytes=-500" means the last 500 bytes
+            length = int(last)
+            if length <= 0:
+                return "invalid"
+            start = max(size - length, 0)
+            end = size - 1
+        else:
+            start = int(first)
+            end = int(last) if last != "" else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        return "invalid"
+
+    return start, min(end, size - 1)
+
+
+def read_file_range(path, start, end):
+    """Yield the bytes from start to end (included) of a file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(VIDEO_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining = remaining - len(chunk)
+            yield chunk
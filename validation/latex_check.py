@@ -0,0 +1,108 @@
+"""
+LaTeX check - a quick look at an equation before anyone runs latex on it.
+
+The AI sometimes writes LaTeX that can't compile: a missing brace, a
+\\left without its \\right, a stray $, or an environment that can't go
+inside manim's align*. Finding that out from latex costs a whole failed
+compile. These checks take microseconds and decide the route for
+show_equation straight away:
+- "latex": looks fine, use MathTex
+- "mathtext": latex would fail, but matplotlib can draw it
+- "text": show the plain text
+
+Only mistakes in the structure are caught here. Commands aren't checked
+against a list: amsmath and amssymb have far too many to list them all,
+and sending a good equation to the fallback looks worse than the odd
+failed compile.
+
+Verdicts are cached per expression.
+"""
+
+import re
+from functools import lru_cache
+
+
+# environments that can go inside manim's align*
+KNOWN_ENVIRONMENTS = set("""
+matrix pmatrix bmatrix Bmatrix vmatrix Vmatrix smallmatrix cases array
+aligned alignedat gathered split subarray
+""".split())
+
+COMMAND = re.compile(r"\\([A-Za-z]+|.)")
+ENVIRONMENT = re.compile(r"\\(begin|end)\s*\{([^}]*)\}")
+
+
+@lru_cache(maxsize=4096)
+def find_latex_problem(text):
+    """
+    Look for things that would make latex fail.
+    Returns a short description of the first problem, or None.
+    """
+    if text.strip() == "":
+        return "empty equation"
+
+    # braces, skipping \{ and \}
+    depth = 0
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            i = i + 2
+            continue
+        if char == "{":
+            depth = depth + 1
+        elif char == "}":
+            depth = depth - 1
+            if depth < 0:
+                return "a } without its {"
+        i = i + 1
+    if depth != 0:
+        return "a { without its }"
+
+    # a $ inside math ends the math mode manim started
+    without_commands = COMMAND.sub("", text)
+    if "$" in without_commands:
+        return "a $ inside the equation"
+
+    commands = [match.group(1) for match in COMMAND.finditer(text)]
+    if commands.count("left") != commands.count("right"):
+        return "\\left and \\right don't match"
+
+    # environments must be known and properly nested
+    stack = []
+    for match in ENVIRONMENT.finditer(text):
+        kind, name = match.group(1), match.group(2).strip()
+        if name not in KNOWN_ENVIRONMENTS:
+            return "unsupported environment " + name
+        if kind == "begin":
+            stack.append(name)
+        elif len(stack) == 0 or stack.pop() != name:
+            return "\\end{" + name + "} without its \\begin"
+    if len(stack) > 0:
+        return "\\begin{" + stack[-1] + "} without its \\end"
+
+    return None
+
+
+@lru_cache(maxsize=4096)
+def mathtext_can_draw(text):
+    """True if matplotlib's mathtext can parse the equation."""
+    try:
+        from matplotlib.mathtext import MathTextParser
+        MathTextParser("path").parse("$" + text + "$")
+        return True
+    except Exception:
+        return False
+
+
+@lru_cache(maxsize=4096)
+def equation_route(text):
+    """How show_equation should draw text: "latex", "mathtext" or "text"."""
+    problem = find_latex_problem(text)
+    if problem is None:
+        return "latex"
+
+    print("Skipping LaTeX for " + repr(text[:40]) + ": " + problem)
+    if mathtext_can_draw(text):
+        return "mathtext"
+    return "text"